@@ -8,6 +8,12 @@
     3. Partially follow to the codes by QiangYe:
     https://github.com/qqiang00/Reinforce/tree/master/reinforce/codes_for_book/c03
 '''
+import time
+import heapq
+import numpy as np
+from mdp import DenseModel, grid_world, solve_policy_value, \
+                batch_value_iterate
+from parallel import ParallelSolver
 
 ## enviroment ##
 def env(s, a):
@@ -28,16 +34,16 @@ def env(s, a):
     ##                   be forced to stay at the same position (state);
     ##                2) if the agent has entering the terminate state, it will
     ##                   stays at there forever.
-    if (s%4 == 0 and a == 'w') or (s<4 and a == 'n')  or \
-        ((s+1)%4 == 0 and a == 'e') or (s>11 and a == 's') or \
-        (s in [0, 15]):
+    if (s%n_width == 0 and a == 'w') or (s<n_width and a == 'n')  or \
+        ((s+1)%n_width == 0 and a == 'e') or \
+        (s>=n_width*(n_height-1) and a == 's') or (s in ends):
             s_next = s
     
     else:
         s_next = s + a_on_s[a]
     
-    r = 0 if s in [0, 15] else -1
-    is_end = (s in [0, 15])
+    r = 0 if s in ends else -1
+    is_end = (s in ends)
     
     return s_next, r, is_end
 
@@ -53,89 +59,90 @@ def R(s, a):
 
 
 class uniform_random_policy():
-    def __init__(self, MDP):
+    def __init__(self, MDP, model = None):
         self.S, self.A, self.R, self.P, self.gamma = MDP
+        ## compile the dynamics into arrays only once ##
+        if model is None:
+            model = DenseModel.from_functions(self.S, self.A, self.P, self.R)
+        self.model = model
         ## initial (state) value function ##
-        self.V = [0 for _ in range(len(self.S))]
+        self.V = np.zeros(len(self.S))
         self.update_policy()
     
     def update_policy(self):
-        self.policy = {}
-        for s in self.S:
-            p = {a: 1.0/len(self.A) for a in self.A}
-            self.policy[s] = p
+        ## policy[s, a] = \pi(a | s) ##
+        self.policy = np.full((len(self.S), len(self.A)), 1.0/len(self.A))
     
-    def policy_evaluate(self, N = 1):
-        for n in range(N):
-            self.update_value()
+    def policy_evaluate(self, N = None, theta = 1e-6, mode = 'sweep',
+                        method = 'direct'):
+        '''
+            Evaluate the current policy.
+                - mode = 'sweep':   repeat Bellman sweeps until the max-norm
+                                    residual between two successive sweeps drops
+                                    below 'theta' (at most 'N' sweeps).
+                - mode = 'linear':  solve (I - γP_π)V = R_π directly, 'method'
+                                    is either 'direct' or 'iterative'.
+            Returns the number of sweeps (1 for the linear solve).
+        '''
+        assert mode in ['sweep', 'linear'], f"Illegal mode: {mode}"
+        if mode == 'linear':
+            self.V = solve_policy_value(self.model, self.policy, self.gamma,
+                                        method=method, V0=self.V)
+            return 1
+        
+        n = 0
+        while N is None or n < N:
+            delta = self.update_value()
+            n += 1
+            if delta < theta:
+                break
+        return n
     
     def update_value(self):
         '''
             Update the value function according to the Bellman Equation.
+            Returns the max-norm residual of the update.
         '''
-        V = self.V.copy()
-        for s in self.S:
-            v_new = 0
-            ## get V_{k+1}(s) from V_{k}(s) ##
-            for a in self.A:
-                v_next_sum = 0
-                p = self.policy[s][a]
-                for s_next in self.S:
-                    v_next_sum += self.P(s, s_next, a) * V[s_next]
-                v_new += p * (R(s,a) + self.gamma * v_next_sum)
-            self.V[s] = v_new
-    
-    def display_value(self):
+        Q = self.model.q_values(self.V, self.gamma)
+        V = (self.policy * Q).sum(axis=1)
+        delta = np.max(np.abs(V - self.V))
+        self.V = V
+        return delta
+    
+    def display_value(self, n_width = 4):
         for i in range(len(self.V)):
             print('{0:>6.2f}'.format(self.V[i]), end = " ")
-            if (i+1) % 4 == 0:
+            if (i+1) % n_width == 0:
                 print("")
         print()
     
     def display_policy(self):
-        for s in self.S:
+        for i, s in enumerate(self.S):
             p = ""
             print("State {:0>2}：".format(s), end=" ")
-            for a in self.A:
-                if self.policy[s][a] != 0:
-                    p += "{} ({:^4.2f}) ".format(a, self.policy[s][a])
+            for j, a in enumerate(self.A):
+                if self.policy[i, j] != 0:
+                    p += "{} ({:^4.2f}) ".format(a, self.policy[i, j])
             print(p)
         
 
 class greedy_policy(uniform_random_policy):
-    def __init__(self, MDP):
-        super().__init__(MDP)
+    def __init__(self, MDP, model = None):
+        super().__init__(MDP, model)
 
     def update_policy(self):
         '''
             Give the greedy policy according to the current value function.
+            Returns the Bellman optimality residual max|max_a q(s, a) - V(s)|.
         '''
         ## calculate the action-value function q(s, a) ##
-        self.policy = {}
-        
-        Q = {}
-        for s in self.S:
-            q = {}
-            for a in self.A:
-                v_next_sum = 0
-                for s_next in self.S:
-                    v_next_sum += self.P(s, s_next, a) * self.V[s_next]
-                q[a] = self.R(s, a) + self.gamma * v_next_sum
-            Q[s] = q
+        Q = self.model.q_values(self.V, self.gamma)
         
-        ## determine the newer and better policy ##
-        for s in self.S:
-            p = {}
-            max_q = max(Q[s].values())
-            max_cnt = 0
-            for a in self.A:
-                if (Q[s][a] == max_q):
-                    p[a] = 1.0
-                    max_cnt += 1
-                else:
-                    p[a] = 0.0
-            p = {k: v/max_cnt for k,v in p.items()}
-            self.policy[s] = p
+        ## determine the newer and better policy, ties share the probability ##
+        max_q = Q.max(axis=1, keepdims=True)
+        p = np.isclose(Q, max_q).astype(np.float64)
+        self.policy = p / p.sum(axis=1, keepdims=True)
+        return np.max(np.abs(max_q[:, 0] - self.V))
     
     def policy_iterate(self, eval_N = 1, N = 1):
         '''
@@ -147,49 +154,183 @@ class greedy_policy(uniform_random_policy):
             self.policy_evaluate(eval_N)
             self.update_policy()
     
-    def value_iterate(self, N = 1):
+    def modified_policy_iterate(self, eval_N = None, max_iter = 1000,
+                                method = 'direct'):
         '''
-            Implement value iteration for 'N' times.
+            Modified policy iteration: evaluate the current policy with
+            'eval_N' sweeps (or exactly by a linear solve if 'eval_N' is None)
+            and then improve it greedily, until the greedy policy is stable.
+            Returns the number of iterations; the iterations, residuals and
+            wall time are recorded in 'self.stats'.
         '''
-        for _ in range(N):
-            V = self.V.copy()
-            for s in self.S:
-                v_new = -float('inf')
-                for a in self.A:
-                    v_next_sum = 0
-                    for s_next in self.S:
-                        v_next_sum += self.P(s, s_next, a) * V[s_next]
-                    v_new = max(self.R(s, a)+self.gamma*v_next_sum, v_new)
-                self.V[s] = v_new
+        start = time.perf_counter()
+        residuals = []
+        n = 0
+        while n < max_iter:
+            if eval_N is None:
+                self.policy_evaluate(mode='linear', method=method)
+            else:
+                self.policy_evaluate(eval_N)
+            old_policy = self.policy
+            residuals.append(self.update_policy())
+            n += 1
+            if np.array_equal(old_policy, self.policy):
+                break
+        self.stats = {"iterations": n, "residuals": residuals,
+                      "time": time.perf_counter() - start}
+        return n
+    
+    def value_iterate(self, N = None, theta = 1e-6):
+        '''
+            Implement value iteration until the max-norm residual drops below
+            'theta' (at most 'N' times). Returns the number of iterations;
+            the iterations, residuals and wall time are recorded in 'self.stats'.
+        '''
+        start = time.perf_counter()
+        residuals = []
+        n = 0
+        while N is None or n < N:
+            V = self.model.q_values(self.V, self.gamma).max(axis=1)
+            delta = np.max(np.abs(V - self.V))
+            self.V = V
+            residuals.append(delta)
+            n += 1
+            if delta < theta:
+                break
+        self.stats = {"iterations": n, "backups": n * len(self.S),
+                      "residuals": residuals, "time": time.perf_counter() - start}
+        return n
+    
+    def prioritized_sweep(self, theta = 1e-6, max_backups = None):
+        '''
+            Asynchronous (in-place, Gauss-Seidel) value iteration with
+            prioritized sweeping. States are backed up one at a time in the
+            order of their Bellman error, and after a backup only the
+            predecessors of the changed state are re-prioritized.
+            Returns the number of backups; the backups, the final residual and
+            wall time are recorded in 'self.stats'.
+        '''
+        start = time.perf_counter()
+        model, gamma = self.model, self.gamma
+        pred_indptr, pred_states = model.predecessors()
+        V = np.array(self.V, dtype=np.float64)
+        
+        ## priority queue keyed by the Bellman error, stale entries are skipped ##
+        errors = np.abs(model.q_values(V, gamma).max(axis=1) - V)
+        priority = np.where(errors > theta, errors, 0.0).tolist()
+        heap = [(-priority[s], s) for s in np.nonzero(errors > theta)[0].tolist()]
+        heapq.heapify(heap)
+        
+        n = 0
+        while heap and (max_backups is None or n < max_backups):
+            neg_error, s = heapq.heappop(heap)
+            if -neg_error != priority[s]:
+                continue
+            priority[s] = 0.0
+            V[s] = model.state_q_values(s, V, gamma).max()
+            n += 1
+            for p in pred_states[pred_indptr[s]:pred_indptr[s+1]].tolist():
+                error = abs(model.state_q_values(p, V, gamma).max() - V[p])
+                if error > theta:
+                    priority[p] = error
+                    heapq.heappush(heap, (-error, p))
+                else:
+                    priority[p] = 0.0
+        
+        self.V = V
+        residual = np.max(np.abs(model.q_values(V, gamma).max(axis=1) - V))
+        self.stats = {"backups": n, "residuals": [residual],
+                      "time": time.perf_counter() - start}
+        return n
 
 
 if __name__ == '__main__':
-    ITER_NUM = 200
+    THETA = 1e-6
+    
+    ## grid size and terminate states ##
+    n_width, n_height = 4, 4
+    ends = [0, n_width*n_height-1]
     
     ## state space ##
-    S = [i for i in range(16)]
+    S = [i for i in range(n_width*n_height)]
 
     ## action space ##
     A = ['n', 'e', 's', 'w']
-    a_on_s = {'n': -4, 'e': +1, 's': +4, 'w': -1} ## impact of the action on the state
+    a_on_s = {'n': -n_width, 'e': +1, 's': +n_width, 'w': -1} ## impact of the action on the state
     
     gamma = 1.00
     MDP = S, A, R, P, gamma
+    ## the environment is deterministic: compile it with |S|·|A| calls ##
+    model = DenseModel.from_env(S, A, env)
     
-    UP = uniform_random_policy(MDP)
-    UP.policy_evaluate(ITER_NUM)
-    print("Value Function of Uniform Random Policy (after 100 evaluation):")
+    UP = uniform_random_policy(MDP, model)
+    n = UP.policy_evaluate(theta = THETA)
+    print("Value Function of Uniform Random Policy (after {} evaluation):".format(n))
     UP.display_value()
     
-    GP1 = greedy_policy(MDP)
-    GP1.policy_iterate(1, 100)
-    print("Value Function of Greedy Policy (after 100 policy iterations):")
+    GP1 = greedy_policy(MDP, model)
+    n = GP1.modified_policy_iterate()
+    print("Value Function of Greedy Policy (after {} policy iterations, {:.4f}s):"
+          .format(n, GP1.stats["time"]))
     GP1.display_value()
     
-    GP2 = greedy_policy(MDP)
-    GP2.value_iterate(4)
-    print("Value Function of Greedy Policy (after 4 value iterations):")
+    GP2 = greedy_policy(MDP, model)
+    n = GP2.value_iterate(theta = THETA)
+    print("Value Function of Greedy Policy (after {} value iterations, {:.4f}s):"
+          .format(n, GP2.stats["time"]))
     GP2.display_value()
     GP2.update_policy()
     print("Optimal Policy using Greddy Value Iteration:")
-    GP2.display_policy()
\ No newline at end of file
+    GP2.display_policy()
+    
+    ## a large grid solved through the sparse (CSR) model ##
+    large_model = grid_world(200, 200)
+    GP3 = greedy_policy((large_model.S, large_model.A, None, None, gamma),
+                        large_model)
+    n = GP3.value_iterate(theta = THETA)
+    print("Value iteration on a 200x200 grid converged after {} iterations"
+          " ({:.2f}s), V(center) = {:.2f}".format(n, GP3.stats["time"],
+                                                  GP3.V[100*200+100]))
+    GP4 = greedy_policy((large_model.S, large_model.A, None, None, gamma),
+                        large_model)
+    n = GP4.modified_policy_iterate()
+    print("Policy iteration on a 200x200 grid converged after {} iterations"
+          " ({:.2f}s), V(center) = {:.2f}".format(n, GP4.stats["time"],
+                                                  GP4.V[100*200+100]))
+    
+    ## a sparse-reward grid: only entering the goal is rewarded ##
+    goal_model = grid_world(200, 200, ends=[100*200+150], reward=0.0, end_reward=1.0)
+    goal_MDP = goal_model.S, goal_model.A, None, None, 0.95
+    GP5 = greedy_policy(goal_MDP, goal_model)
+    GP5.value_iterate(theta = THETA)
+    GP6 = greedy_policy(goal_MDP, goal_model)
+    GP6.prioritized_sweep(theta = THETA)
+    print("Sparse-reward 200x200 grid: value iteration {} backups ({:.2f}s),"
+          " prioritized sweeping {} backups ({:.2f}s), max |dV| = {:.2e}".format(
+          GP5.stats["backups"], GP5.stats["time"], GP6.stats["backups"],
+          GP6.stats["time"], np.max(np.abs(GP5.V - GP6.V))))
+    
+    ## a sensitivity sweep over the discount factor in one stacked solve,
+    ## compared with solving the same discount factors one by one ##
+    gammas = np.linspace(0.80, 0.99, 20)
+    start = time.perf_counter()
+    for g in gammas:
+        batch_value_iterate(large_model, [g], theta = THETA)
+    separate = time.perf_counter() - start
+    start = time.perf_counter()
+    V, policy, iterations = batch_value_iterate(large_model, gammas, theta = THETA)
+    elapsed = time.perf_counter() - start
+    print("Batched value iteration of {} discount factors on a 200x200 grid"
+          " ({:.2f}s, {} variant sweeps; {:.2f}s solved one by one, ratio {:.2f}):"
+          .format(len(gammas), elapsed, iterations.sum(), separate,
+                  elapsed / separate))
+    for g, v, n in zip(gammas[::5], V[::5], iterations[::5]):
+        print("    gamma = {:.2f}: {} iterations, V(center) = {:.2f}".format(
+              g, n, v[100*200+100]))
+    
+    ## the same sweeps sharded across all the cores ##
+    with ParallelSolver(large_model, gamma) as PS:
+        n = PS.value_iterate(theta = THETA)
+        print("Parallel value iteration on a 200x200 grid with {} workers converged"
+              " after {} iterations ({:.2f}s), V(center) = {:.2f}".format(
+              PS.n_workers, n, PS.stats["time"], PS.V[100*200+100]))
\ No newline at end of file
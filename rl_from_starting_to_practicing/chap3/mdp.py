@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+
+'''
+    Tabular MDP models: the dynamics are compiled once into NumPy arrays so
+    that policy evaluation, policy improvement and value iteration can run
+    as batched array operations instead of loops over S×A×S'.
+'''
+import numpy as np
+
+class DenseModel():
+    '''
+        Tabular MDP stored as dense arrays:
+            - P:    transition tensor, P[a, s, s1] = p(s1 | s, a)
+            - R:    reward matrix, R[s, a]
+    '''
+    def __init__(self, S, A, P, R):
+        self.S = list(S)
+        self.A = list(A)
+        self.n_states = len(self.S)
+        self.n_actions = len(self.A)
+        self.P = np.asarray(P, dtype=np.float64)
+        self.R = np.asarray(R, dtype=np.float64)
+        assert self.P.shape == (self.n_actions, self.n_states, self.n_states), \
+            f"Illegal transition tensor shape: {self.P.shape}"
+        assert self.R.shape == (self.n_states, self.n_actions), \
+            f"Illegal reward matrix shape: {self.R.shape}"
+        self._predecessors = None
+
+    @classmethod
+    def from_functions(cls, S, A, P, R):
+        '''
+            Compile the transition function P(s, s1, a) and the reward
+            function R(s, a). Each entry is evaluated only once.
+        '''
+        P_arr = np.array([[[P(s, s1, a) for s1 in S] for s in S] for a in A],
+                         dtype=np.float64)
+        R_arr = np.array([[R(s, a) for a in A] for s in S], dtype=np.float64)
+        return cls(S, A, P_arr, R_arr)
+
+    @classmethod
+    def from_env(cls, S, A, env):
+        '''
+            Compile a deterministic environment env(s, a) -> (s_next, r, is_end),
+            which only needs |S|·|A| calls of 'env'.
+        '''
+        S, A = list(S), list(A)
+        s_index = {s: i for i, s in enumerate(S)}
+        P_arr = np.zeros((len(A), len(S), len(S)))
+        R_arr = np.zeros((len(S), len(A)))
+        for i, s in enumerate(S):
+            for j, a in enumerate(A):
+                s_next, r, _ = env(s, a)
+                P_arr[j, i, s_index[s_next]] = 1.0
+                R_arr[i, j] = r
+        return cls(S, A, P_arr, R_arr)
+
+    def expected_next_value(self, V):
+        '''
+            Return E[V(s1) | s, a] for every (s, a) pair, shape [|S|, |A|].
+        '''
+        return (self.P @ V).T
+
+    def batch_expected_next_value(self, V):
+        '''
+            Batched version for K value functions stored as V[s, k],
+            returns shape [|S|, |A|, K].
+        '''
+        return (self.P @ V).transpose(1, 0, 2)
+
+    def q_values(self, V, gamma):
+        '''
+            One step look-ahead: q(s, a) = R(s, a) + γ·Σ p(s1|s,a)·V(s1).
+        '''
+        return self.R + gamma * self.expected_next_value(V)
+
+    def state_q_values(self, s, V, gamma):
+        '''
+            One step look-ahead q(s, ·) of the single state with index 's'.
+        '''
+        return self.R[s] + gamma * (self.P[:, s, :] @ V)
+
+    def predecessors(self):
+        '''
+            Predecessor index in CSR form: the predecessors of state s1 are
+            pred_states[pred_indptr[s1]:pred_indptr[s1+1]].
+        '''
+        if self._predecessors is None:
+            dst, src = np.nonzero(self.P.any(axis=0).T)
+            self._predecessors = _csr_from_pairs(dst, src, self.n_states)
+        return self._predecessors
+
+    def policy_transition(self, policy):
+        '''
+            Return P_π[s, s1] and R_π[s] of a policy given as policy[s, a].
+        '''
+        P_pi = np.einsum('sa,ast->st', policy, self.P)
+        R_pi = (policy * self.R).sum(axis=1)
+        return P_pi, R_pi
+
+
+class SparseModel():
+    '''
+        Tabular MDP stored in CSR form with one row per (s, a) pair, the row
+        index being s·|A| + a:
+            - indptr:   row pointers, shape [|S|·|A| + 1]
+            - indices:  successor state indices, shape [nnz]
+            - probs:    transition probabilities, shape [nnz]
+            - R:        reward matrix, R[s, a]
+        A Bellman backup costs O(nnz) instead of O(|S|²·|A|).
+    '''
+    def __init__(self, S, A, indptr, indices, probs, R):
+        self.S = S if isinstance(S, range) else list(S)
+        self.A = list(A)
+        self.n_states = len(self.S)
+        self.n_actions = len(self.A)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.probs = np.asarray(probs, dtype=np.float64)
+        self.R = np.asarray(R, dtype=np.float64)
+        assert len(self.indptr) == self.n_states * self.n_actions + 1, \
+            f"Illegal row pointer length: {len(self.indptr)}"
+        assert self.R.shape == (self.n_states, self.n_actions), \
+            f"Illegal reward matrix shape: {self.R.shape}"
+        ## the (s, a) row of every stored transition ##
+        row_nnz = np.diff(self.indptr)
+        self._rows = np.repeat(np.arange(self.n_states * self.n_actions), row_nnz)
+        ## deterministic models store exactly one successor per row ##
+        self._one_per_row = bool(np.all(row_nnz == 1))
+        self._predecessors = None
+
+    @classmethod
+    def from_env(cls, S, A, env):
+        '''
+            Compile a deterministic environment env(s, a) -> (s_next, r, is_end),
+            one stored transition per (s, a) pair.
+        '''
+        S, A = list(S), list(A)
+        s_index = {s: i for i, s in enumerate(S)}
+        indices = np.zeros((len(S), len(A)), dtype=np.int64)
+        R_arr = np.zeros((len(S), len(A)))
+        for i, s in enumerate(S):
+            for j, a in enumerate(A):
+                s_next, r, _ = env(s, a)
+                indices[i, j] = s_index[s_next]
+                R_arr[i, j] = r
+        indptr = np.arange(len(S) * len(A) + 1)
+        return cls(S, A, indptr, indices.ravel(), np.ones(indices.size), R_arr)
+
+    @classmethod
+    def from_dense(cls, model):
+        '''
+            Convert a DenseModel, keeping only the nonzero transitions.
+        '''
+        P = model.P.transpose(1, 0, 2).reshape(-1, model.n_states)
+        rows, indices = np.nonzero(P)
+        indptr = np.zeros(len(P) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(P)), out=indptr[1:])
+        return cls(model.S, model.A, indptr, indices, P[rows, indices], model.R)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def expected_next_value(self, V):
+        '''
+            Return E[V(s1) | s, a] for every (s, a) pair, shape [|S|, |A|].
+        '''
+        if self._one_per_row:
+            EV = self.probs * V[self.indices]
+        else:
+            EV = np.bincount(self._rows, weights=self.probs * V[self.indices],
+                             minlength=self.n_states * self.n_actions)
+        return EV.reshape(self.n_states, self.n_actions)
+
+    def batch_expected_next_value(self, V):
+        '''
+            Batched version for K value functions stored as V[s, k], so that
+            every successor gathers K contiguous values. Returns shape
+            [|S|, |A|, K].
+        '''
+        EV = V[self.indices]
+        EV *= self.probs[:, None]
+        if not self._one_per_row:
+            ## sum the stored transitions of every non-empty (s, a) row ##
+            starts = self.indptr[:-1]
+            nonempty = starts < self.indptr[1:]
+            out = np.zeros((len(starts), V.shape[1]))
+            out[nonempty] = np.add.reduceat(EV, starts[nonempty], axis=0)
+            EV = out
+        return EV.reshape(self.n_states, self.n_actions, V.shape[1])
+
+    def q_values(self, V, gamma):
+        '''
+            One step look-ahead: q(s, a) = R(s, a) + γ·Σ p(s1|s,a)·V(s1).
+        '''
+        return self.R + gamma * self.expected_next_value(V)
+
+    def state_q_values(self, s, V, gamma):
+        '''
+            One step look-ahead q(s, ·) of the single state with index 's'.
+        '''
+        row = s * self.n_actions
+        lo, hi = self.indptr[row], self.indptr[row + self.n_actions]
+        if self._one_per_row:
+            EV = self.probs[lo:hi] * V[self.indices[lo:hi]]
+        else:
+            EV = np.bincount(self._rows[lo:hi] - row,
+                             weights=self.probs[lo:hi] * V[self.indices[lo:hi]],
+                             minlength=self.n_actions)
+        return self.R[s] + gamma * EV
+
+    def predecessors(self):
+        '''
+            Predecessor index in CSR form: the predecessors of state s1 are
+            pred_states[pred_indptr[s1]:pred_indptr[s1+1]].
+        '''
+        if self._predecessors is None:
+            nonzero = self.probs != 0
+            src = self._rows[nonzero] // self.n_actions
+            dst = self.indices[nonzero]
+            ## drop duplicated (s1, s) pairs ##
+            key = np.unique(dst * self.n_states + src)
+            self._predecessors = _csr_from_pairs(key // self.n_states,
+                                                 key % self.n_states,
+                                                 self.n_states)
+        return self._predecessors
+
+    def policy_transition(self, policy):
+        '''
+            Return P_π[s, s1] as a scipy CSR matrix and R_π[s] of a policy
+            given as policy[s, a].
+        '''
+        from scipy import sparse
+        weights = self.probs * policy.ravel()[self._rows]
+        P_pi = sparse.csr_matrix((weights, (self._rows // self.n_actions, self.indices)),
+                                 shape=(self.n_states, self.n_states))
+        R_pi = (policy * self.R).sum(axis=1)
+        return P_pi, R_pi
+
+
+def _csr_from_pairs(rows, cols, n_rows):
+    '''
+        Build (indptr, indices) from (row, col) pairs sorted by row.
+    '''
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, np.asarray(cols, dtype=np.int64)
+
+
+def solve_policy_value(model, policy, gamma, method = 'direct', V0 = None,
+                       tol = 1e-10):
+    '''
+        Exact policy evaluation: solve (I - γP_π)V = R_π.
+        Args:
+            - model:    DenseModel or SparseModel
+            - policy:   policy[s, a] = π(a | s)
+            - method:   'direct' (LU factorization) or 'iterative' (BiCGSTAB,
+                        sparse models only)
+            - V0:       initial guess of the iterative solver
+            - tol:      residual tolerance of the iterative solver
+        When γ = 1 the absorbing states (p(s|s) = 1) are pinned to V(s) = 0,
+        otherwise the system is singular. This only holds for the terminal
+        states, which pay no reward: an absorbing state with a reward, e.g.
+        bumping into a wall forever, means the policy is improper and its
+        values diverge, so a ValueError is raised. So is a LinAlgError when
+        the system is singular for any other reason.
+    '''
+    assert method in ['direct', 'iterative'], f"Illegal method: {method}"
+    P_pi, R_pi = model.policy_transition(policy)
+    n = model.n_states
+    if gamma == 1:
+        absorbing = P_pi.diagonal() == 1
+        looping = np.flatnonzero(absorbing & (R_pi != 0))
+        if len(looping) > 0:
+            s = int(looping[0])
+            raise(ValueError(f"Improper policy: state {s} loops on itself with "
+                             f"reward {R_pi[s]}, its value diverges when γ = 1"))
+        keep = (~absorbing).astype(np.float64)
+        R_pi = R_pi * keep
+    
+    if isinstance(P_pi, np.ndarray):
+        if gamma == 1:
+            P_pi = P_pi * keep[:, None]
+        return np.linalg.solve(np.eye(n) - gamma * P_pi, R_pi)
+    
+    from scipy import sparse
+    from scipy.sparse import linalg
+    if gamma == 1:
+        P_pi = sparse.diags(keep) @ P_pi
+    M = (sparse.identity(n, format='csr') - gamma * P_pi).tocsc()
+    if method == 'direct':
+        V = linalg.spsolve(M, R_pi)
+        ## spsolve warns and returns NaNs on a singular system ##
+        if not np.all(np.isfinite(V)):
+            raise(np.linalg.LinAlgError("Singular matrix: the policy is improper"))
+        return V
+    ## the tolerance keyword was renamed to 'rtol' in scipy 1.12 ##
+    try:
+        V, info = linalg.bicgstab(M, R_pi, x0=V0, rtol=tol, atol=0.0)
+    except TypeError:
+        V, info = linalg.bicgstab(M, R_pi, x0=V0, tol=tol, atol=0.0)
+    assert info == 0, f"BiCGSTAB did not converge: {info}"
+    return V
+
+
+def batch_value_iterate(model, gammas, rewards = None, N = None, theta = 1e-6):
+    '''
+        Value iteration of K variants of 'model' at once. The variants share
+        the transitions of the model and are stacked into one array
+        computation; converged variants drop out of the following sweeps.
+        This saves the per-sweep overhead of K separate solves, not their
+        work: a sweep still touches K values per transition and lasts as long
+        as the slowest variant needs. main.py times a batch against the same
+        discount factors solved one by one.
+        Args:
+            - gammas:   K discount factors
+            - rewards:  reward matrices of shape [K, |S|, |A|] (or [|S|, |A|]
+                        shared by all variants), defaults to model.R
+            - N, theta: at most 'N' sweeps, until the max-norm residual of
+                        each variant drops below 'theta'
+        Returns:
+            - V:            value tables, shape [K, |S|]
+            - policy:       greedy policies, shape [K, |S|, |A|]
+            - iterations:   number of sweeps of every variant, shape [K]
+    '''
+    gammas = np.asarray(gammas, dtype=np.float64).ravel()
+    K = len(gammas)
+    R = model.R if rewards is None else np.asarray(rewards, dtype=np.float64)
+    R = np.broadcast_to(R, (K, model.n_states, model.n_actions))
+    
+    ## variants are stored along the last axis: R[s, a, k], V[s, k] ##
+    V = np.zeros((model.n_states, K))
+    iterations = np.zeros(K, dtype=np.int64)
+    active = np.arange(K)
+    V_act, R_act, g_act = V.copy(), np.ascontiguousarray(R.transpose(1, 2, 0)), gammas
+    n = 0
+    while len(active) > 0 and (N is None or n < N):
+        Q = model.batch_expected_next_value(V_act)
+        Q *= g_act
+        Q += R_act
+        V_new = Q.max(axis=1)
+        delta = np.max(np.abs(V_new - V_act), axis=0)
+        V_act = V_new
+        iterations[active] += 1
+        n += 1
+        ## the stacked arrays only shrink when some variant converges ##
+        done = delta < theta
+        if done.any():
+            V[:, active[done]] = V_act[:, done]
+            keep = ~done
+            active, g_act = active[keep], g_act[keep]
+            V_act, R_act = V_act[:, keep], R_act[:, :, keep]
+    V[:, active] = V_act
+    
+    ## greedy policies, ties share the probability ##
+    Q = model.batch_expected_next_value(V) * gammas + R.transpose(1, 2, 0)
+    p = np.isclose(Q, Q.max(axis=1, keepdims=True)).astype(np.float64)
+    policy = (p / p.sum(axis=1, keepdims=True)).transpose(2, 0, 1)
+    return V.T.copy(), policy, iterations
+
+
+def grid_world(n_width, n_height, ends = None, reward = -1.0, end_reward = None):
+    '''
+        Build the grid world of chap3 for any size as a SparseModel.
+        Args:
+            - n_width, n_height:    size of the grid, state s = y*n_width + x
+            - ends:     terminal states, defaults to the two opposite corners
+            - reward:   reward of every step out of a non-terminal state
+            - end_reward:   if given, reward of the steps entering a terminal
+                            state instead (e.g. a sparse-reward goal)
+        Actions 'n', 'e', 's', 'w' move the agent by one grid, moving out of
+        the boundary keeps it in place and a terminal state is absorbing.
+    '''
+    n_states = n_width * n_height
+    if ends is None:
+        ends = [0, n_states - 1]
+    ends = np.asarray(ends, dtype=np.int64)
+    
+    s = np.arange(n_states, dtype=np.int64)
+    x, y = s % n_width, s // n_width
+    s_next = np.empty((n_states, 4), dtype=np.int64)
+    s_next[:, 0] = np.where(y > 0, s - n_width, s)              # n
+    s_next[:, 1] = np.where(x < n_width - 1, s + 1, s)          # e
+    s_next[:, 2] = np.where(y < n_height - 1, s + n_width, s)   # s
+    s_next[:, 3] = np.where(x > 0, s - 1, s)                    # w
+    R = np.full((n_states, 4), reward, dtype=np.float64)
+    if end_reward is not None:
+        R[np.isin(s_next, ends)] = end_reward
+    s_next[ends] = ends[:, None]
+    R[ends] = 0
+    
+    indptr = np.arange(n_states * 4 + 1)
+    return SparseModel(range(n_states), ['n', 'e', 's', 'w'], indptr,
+                       s_next.ravel(), np.ones(s_next.size), R)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+
+'''
+    Multi-core Bellman sweeps for a SparseModel.
+    The CSR transition arrays, the reward matrix, the policy and two value
+    buffers live in 'multiprocessing.shared_memory'. Every worker owns a
+    contiguous shard of the state space and, per sweep, backs it up from the
+    current value buffer into the other one (Jacobi scheme). Two barriers
+    delimit a sweep: one to start it and one to wait until all shards are done.
+    A worker that fails aborts the barriers, so the solver raises instead of
+    waiting for it forever.
+'''
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+## commands sent to the workers through the shared control block ##
+_STOP, _VALUE_ITERATE, _POLICY_EVALUATE = 0, 1, 2
+
+
+def _share(array):
+    '''
+        Copy 'array' into a new shared memory block.
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, view
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker(worker_id, lo, hi, n_actions, specs, start_barrier, done_barrier):
+    '''
+        Back up the states [lo, hi) once per sweep until told to stop.
+    '''
+    try:
+        _backup(worker_id, lo, hi, n_actions, specs, start_barrier, done_barrier)
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        ## release the solver and the other workers ##
+        start_barrier.abort()
+        done_barrier.abort()
+        raise
+
+
+def _backup(worker_id, lo, hi, n_actions, specs, start_barrier, done_barrier):
+    ## keep the blocks referenced, they are released when the process exits ##
+    shms, arrays = [], {}
+    for key, spec in specs.items():
+        shm, arrays[key] = _attach(spec)
+        shms.append(shm)
+    indptr, indices, probs = arrays["indptr"], arrays["indices"], arrays["probs"]
+    R, policy = arrays["R"][lo:hi], arrays["policy"][lo:hi]
+    V, control, deltas = arrays["V"], arrays["control"], arrays["deltas"]
+
+    ## local view of the shard's CSR rows ##
+    row_lo, row_hi = lo * n_actions, hi * n_actions
+    ptr_lo, ptr_hi = indptr[row_lo], indptr[row_hi]
+    succ = indices[ptr_lo:ptr_hi]
+    p = probs[ptr_lo:ptr_hi]
+    row_nnz = np.diff(indptr[row_lo:row_hi+1])
+    one_per_row = bool(np.all(row_nnz == 1))
+    rows = np.repeat(np.arange(row_hi - row_lo), row_nnz)
+
+    while True:
+        start_barrier.wait()
+        command, gamma, cur = int(control[0]), control[1], int(control[2])
+        if command == _STOP:
+            break
+        V_old, V_new = V[cur], V[1-cur]
+        if one_per_row:
+            EV = p * V_old[succ]
+        else:
+            EV = np.bincount(rows, weights=p * V_old[succ],
+                             minlength=row_hi - row_lo)
+        Q = R + gamma * EV.reshape(hi - lo, n_actions)
+        if command == _VALUE_ITERATE:
+            V_new[lo:hi] = Q.max(axis=1)
+        else:
+            V_new[lo:hi] = (policy * Q).sum(axis=1)
+        deltas[worker_id] = np.max(np.abs(V_new[lo:hi] - V_old[lo:hi])) \
+                            if hi > lo else 0.0
+        done_barrier.wait()
+
+
+class ParallelSolver():
+    '''
+        Jacobi value iteration and policy evaluation of a SparseModel sharded
+        across 'n_workers' processes (defaults to the number of cores).
+        The entry points mirror those of 'greedy_policy' in main.py.
+        A sweep that takes longer than 'timeout' seconds is treated as a hang.
+    '''
+    def __init__(self, model, gamma, n_workers = None, timeout = 600):
+        self.model = model
+        self.gamma = gamma
+        self.n_workers = n_workers or mp.cpu_count()
+        self.timeout = timeout
+        n_states, n_actions = model.n_states, model.n_actions
+        self.stats = {}
+
+        ## policy[s, a] = \pi(a | s) is uniform random by default ##
+        self._shms, self._arrays, specs = [], {}, {}
+        for key, array in [("indptr", model.indptr),
+                           ("indices", model.indices),
+                           ("probs", model.probs),
+                           ("R", model.R),
+                           ("policy", np.full((n_states, n_actions), 1.0/n_actions)),
+                           ("V", np.zeros((2, n_states))),
+                           ("control", np.zeros(3)),
+                           ("deltas", np.zeros(self.n_workers))]:
+            shm, view = _share(array)
+            self._shms.append(shm)
+            self._arrays[key] = view
+            specs[key] = (shm.name, view.shape, view.dtype)
+        self._cur = 0
+
+        self._start_barrier = mp.Barrier(self.n_workers + 1)
+        self._done_barrier = mp.Barrier(self.n_workers + 1)
+        bounds = np.linspace(0, n_states, self.n_workers + 1).astype(np.int64)
+        self._workers = []
+        for i in range(self.n_workers):
+            w = mp.Process(target=_worker,
+                           args=(i, int(bounds[i]), int(bounds[i+1]), n_actions,
+                                 specs, self._start_barrier, self._done_barrier),
+                           daemon=True)
+            w.start()
+            self._workers.append(w)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def V(self):
+        return self._arrays["V"][self._cur].copy()
+
+    @V.setter
+    def V(self, V):
+        self._arrays["V"][self._cur] = V
+
+    @property
+    def policy(self):
+        return self._arrays["policy"].copy()
+
+    @policy.setter
+    def policy(self, policy):
+        self._arrays["policy"][...] = policy
+
+    def _wait(self, barrier):
+        '''
+            Wait for the workers at 'barrier'; if one of them is gone or the
+            barrier breaks or times out, stop all the workers and raise.
+        '''
+        try:
+            ## a process killed inside wait() would block the barrier for good ##
+            if not all(w.is_alive() for w in self._workers):
+                raise(threading.BrokenBarrierError)
+            barrier.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            exitcodes = self._terminate()
+            failed = [i for i, code in enumerate(exitcodes) if code not in (None, 0)]
+            if failed:
+                raise(Exception("worker {} exited with code {}".format(
+                    failed[0], exitcodes[failed[0]]))) from None
+            raise(Exception("the workers did not finish within {}s".format(
+                self.timeout))) from None
+
+    def _terminate(self):
+        '''
+            Stop the workers, returns their exit codes (None for those still
+            running, which are then killed).
+        '''
+        exitcodes = []
+        for w in self._workers:
+            w.join(1)
+            exitcodes.append(w.exitcode)
+            if w.is_alive():
+                w.terminate()
+                w.join()
+        self._workers = []
+        return exitcodes
+
+    def _sweep(self, command):
+        if not self._workers:
+            raise(Exception("the workers are stopped"))
+        control = self._arrays["control"]
+        control[0], control[1], control[2] = command, self.gamma, self._cur
+        self._wait(self._start_barrier)
+        self._wait(self._done_barrier)
+        self._cur = 1 - self._cur
+        return self._arrays["deltas"].max()
+
+    def _iterate(self, command, N, theta):
+        start = time.perf_counter()
+        residuals = []
+        n = 0
+        while N is None or n < N:
+            delta = self._sweep(command)
+            residuals.append(delta)
+            n += 1
+            if delta < theta:
+                break
+        self.stats = {"iterations": n, "backups": n * self.model.n_states,
+                      "residuals": residuals, "time": time.perf_counter() - start}
+        return n
+
+    def value_iterate(self, N = None, theta = 1e-6):
+        '''
+            Implement value iteration until the max-norm residual drops below
+            'theta' (at most 'N' times). Returns the number of iterations.
+        '''
+        return self._iterate(_VALUE_ITERATE, N, theta)
+
+    def policy_evaluate(self, N = None, theta = 1e-6):
+        '''
+            Evaluate 'self.policy' until the max-norm residual between two
+            successive sweeps drops below 'theta' (at most 'N' sweeps).
+            Returns the number of sweeps.
+        '''
+        return self._iterate(_POLICY_EVALUATE, N, theta)
+
+    def update_policy(self):
+        '''
+            Give the greedy policy according to the current value function.
+        '''
+        Q = self.model.q_values(self.V, self.gamma)
+        p = np.isclose(Q, Q.max(axis=1, keepdims=True)).astype(np.float64)
+        self.policy = p / p.sum(axis=1, keepdims=True)
+
+    def close(self):
+        '''
+            Stop the workers and release the shared memory.
+        '''
+        try:
+            if self._workers:
+                self._arrays["control"][0] = _STOP
+                self._wait(self._start_barrier)
+                for w in self._workers:
+                    w.join()
+                self._workers = []
+        finally:
+            self._arrays.clear()
+            for shm in self._shms:
+                shm.close()
+                shm.unlink()
+            self._shms = []
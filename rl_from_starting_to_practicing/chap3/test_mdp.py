@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+import warnings
+import numpy as np
+import pytest
+from mdp import DenseModel, grid_world, solve_policy_value
+
+
+def _dense(model):
+    '''
+        The same MDP as the SparseModel 'model', stored as a DenseModel.
+    '''
+    n, m = model.n_states, model.n_actions
+    P = np.zeros((m, n, n))
+    rows = np.repeat(np.arange(n * m), np.diff(model.indptr))
+    np.add.at(P, (rows % m, rows // m, model.indices), model.probs)
+    return DenseModel(model.S, model.A, P, model.R)
+
+
+## a 3x1 corridor ending at state 0, actions 'n', 'e', 's', 'w' ##
+def _corridor_policy(action_of_state_2):
+    policy = np.zeros((3, 4))
+    policy[0, 3] = policy[1, 3] = 1.0
+    policy[2, action_of_state_2] = 1.0
+    return policy
+
+
+@pytest.mark.parametrize("to_model", [lambda m: m, _dense])
+def test_proper_policy_pins_terminal_states(to_model):
+    model = to_model(grid_world(3, 1, ends=[0]))
+    V = solve_policy_value(model, _corridor_policy(3), 1.0)
+    assert np.allclose(V, [0.0, -1.0, -2.0])
+
+
+@pytest.mark.parametrize("to_model", [lambda m: m, _dense])
+def test_wall_bump_loop_is_improper(to_model):
+    ## state 2 moves east into the wall and pays -1 forever ##
+    model = to_model(grid_world(3, 1, ends=[0]))
+    with pytest.raises(ValueError, match="Improper policy"):
+        solve_policy_value(model, _corridor_policy(1), 1.0)
+
+
+def test_two_state_loop_is_singular():
+    ## states 1 and 2 send the agent to each other forever ##
+    model = grid_world(3, 1, ends=[0])
+    policy = _corridor_policy(3)
+    policy[1] = 0.0
+    policy[1, 1] = 1.0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with pytest.raises(np.linalg.LinAlgError):
+            solve_policy_value(model, policy, 1.0)
+    with pytest.raises(np.linalg.LinAlgError):
+        solve_policy_value(_dense(model), policy, 1.0)
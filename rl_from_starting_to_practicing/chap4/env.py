@@ -1,32 +1,89 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
-import random
+import numpy as np
 from tqdm import tqdm
-from queue import Queue
+
+## a card is coded by its index in CARD_NAMES, a deck has 4 cards of each ##
+CARD_NAMES = ['A','2','3','4','5','6','7','8','9','J','Q','K']
+
+
+class Shoe():
+    '''
+        A shoe of 'n_decks' decks kept as a shuffled array of card codes and a
+        cursor: dealing 'n' cards is a slice. Cards are returned in bulk with
+        'recycle'; once the cursor passes 'penetration' of the shoe, or too few
+        cards are left, the returned and the undealt cards are shuffled
+        together while the cards still in hand stay out.
+        With 'infinite' every card, the first ones included, is drawn
+        independently from one deck; the draws are made in blocks of at least
+        'block' cards.
+    '''
+    def __init__(self, n_decks=1, penetration=1.0, infinite=False, seed=None,
+                 block=4096):
+        self.rng = np.random.default_rng(seed)
+        self.infinite = infinite
+        self.penetration = penetration
+        self.block = block
+        ## cards[:discarded] are returned, cards[discarded:cursor] are in hand ##
+        self.discarded = 0
+        self.cursor = 0
+        if infinite:
+            self.reshuffle()
+        else:
+            self.cards = np.tile(np.arange(len(CARD_NAMES)), 4 * n_decks)
+            self.rng.shuffle(self.cards)
+    
+    def __len__(self):
+        return len(self.cards) - self.cursor
+    
+    def reshuffle(self, n=0):
+        '''
+            Refill the shoe so that at least 'n' cards can be dealt.
+        '''
+        if self.infinite:
+            self.cards = self.rng.integers(len(CARD_NAMES), size=max(self.block, n))
+            self.discarded, self.cursor = 0, 0
+            return
+        in_hand = self.cards[self.discarded:self.cursor]
+        rest = np.concatenate([self.cards[:self.discarded], self.cards[self.cursor:]])
+        self.rng.shuffle(rest)
+        self.cards = np.concatenate([in_hand, rest])
+        self.discarded, self.cursor = 0, len(in_hand)
+        if len(rest) < n:
+            raise(ValueError("cannot deal {} cards, {} are not in hand".format(
+                n, len(rest))))
+    
+    def deal(self, n=1):
+        '''
+            Deal the codes of 'n' cards.
+        '''
+        if self.cursor + n > len(self.cards) or (not self.infinite and \
+           self.cursor >= self.penetration * len(self.cards)):
+            self.reshuffle(n)
+        cards = self.cards[self.cursor:self.cursor+n]
+        self.cursor += n
+        return cards
+    
+    def recycle(self, n):
+        '''
+            Return the 'n' earliest dealt cards that are still in hand.
+        '''
+        if not self.infinite:
+            self.discarded += n
+
 
 class Arena():
     '''
         A class to manage all the game.
     '''
-    def __init__(self, display=None):
-         self.cards = ['A','2','3','4','5','6','7','8','9','J','Q','K'] * 4
+    def __init__(self, display=None, n_decks=1, penetration=1.0, infinite=False,
+                 seed=None):
          self.action_set = ["Bid", "Stop"]
-         self.card_pool = Queue(maxsize=52)
-         self.discarded_cards = []
+         self.shoe = Shoe(n_decks, penetration, infinite, seed)
          
          self.display = display
          self.episodes = []
-         self.load_cards(self.cards)
-    
-    def load_cards(self, cards):
-        '''
-            Shuffle the cards and load them into the card pool.
-        '''
-        random.shuffle(cards)
-        for c in cards:
-            self.card_pool.put(c)
-        cards.clear()
     
     def give_reward(self, dealer, player):
         '''
@@ -50,23 +107,11 @@ class Arena():
     def serve_card(self, player, n=1):
         '''
             Deal 'n' cards to the 'player'.
-            Once there are insufficient cards in the pool, Arena will load cards
+            Once there are insufficient cards in the shoe, it gets reshuffled.
         '''
-        cards = []
-        for _ in range(n):
-            if self.card_pool.empty(): ## no card in the pool ##
-                self._info("No card in the pool.")
-                random.shuffle(self.discarded_cards)
-                self._info("{} discarded cards are shuffed and loaded again.".format(
-                    len(self.discarded_cards)))
-                ## the players are not allowed to have too many cards in hand
-                ## which means when the card pool is empty, there must have
-                ## been enough cards be discarded.
-                assert(len(self.discarded_cards) > 20)
-                self.load_cards(self.discarded_cards)
-            cards.append(self.card_pool.get())
+        cards = self.shoe.deal(n).tolist()
         self._info("Deal {} cards ({}) to {}.{}\n".format(
-            n, cards, player.role, player.name))
+            n, [CARD_NAMES[c] for c in cards], player.role, player.name))
         player.receive_cards(cards)
         player.cards_info()
         self._info("\n")
@@ -75,9 +120,9 @@ class Arena():
     def recycle_cards(self, *players):
         if len(players) == 0:
             return
+        ## all the hands of a game are recycled together, oldest cards first ##
+        self.shoe.recycle(sum(len(p.cards) for p in players))
         for p in players:
-            for c in p.cards:
-                self.discarded_cards.append(c)
             p.discharge_cards()
     
     def play_game(self, dealer, player):
@@ -93,7 +138,8 @@ class Arena():
             player_action = player.policy()
             self._info("{}.{} decides to: {}\n".format(
                 player.role, player.name, player_action))
-            episode.append((player.get_state_name(dealer), player_action))
+            episode.append((player.get_state_index(dealer),
+                            0 if player_action == self.action_set[0] else 1))
             if player_action == self.action_set[0]:
                 self.serve_card(player)
             else:
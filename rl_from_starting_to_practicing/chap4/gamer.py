@@ -2,6 +2,25 @@
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
 import utils
+from env import CARD_NAMES
+
+## point value of each card code (A=1, JQK=10) ##
+CARD_VALUES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10]
+ACE = 0
+
+## (total_point, special_ace_exists) of a hand indexed by [hard total][has ace],
+## the hard total counting every ace as 1; beyond the table no ace can be 11 ##
+MAX_HARD = 31
+POINTS = [[(hard, False), (hard + 10, True) if hard + 10 <= 21 else (hard, False)]
+          for hard in range(MAX_HARD + 1)]
+## the player state (dealer_first_card, total_point, special_ace_exists)
+## indexed by [dealer_first_card][hard total][has ace] ##
+STATES = [[[(dealer_card,) + POINTS[hard][has_ace] for has_ace in range(2)]
+           for hard in range(MAX_HARD + 1)] for dealer_card in range(11)]
+## the same state as a flat index into arrays shaped [11, 32, 2, ...] ##
+STATE_SHAPE = (11, 32, 2)
+STATE_INDICES = [[[(d * 32 + p) * 2 + u for d, p, u in by_ace] for by_ace in by_hard]
+                 for by_hard in STATES]
 
 class Gamer():
     '''
@@ -16,6 +35,10 @@ class Gamer():
         self.action_set = ["Bid", "Stop"]
         
         self.cards = []
+        ## running state of the hand, updated as cards come ##
+        self.hard = 0               # total points with every ace as 1
+        self.aces = 0               # number of aces
+        self.first_card_value = 0
     
     def __str__(self):
         return self.name
@@ -26,16 +49,9 @@ class Gamer():
 
     def _card_value(self, card):
         '''
-            Get the value of a card: 2-9 go without saying; A is 1, JQK are 10
+            Get the value of a card code: 2-9 go without saying; A is 1, JQK are 10
         '''
-        if card == 'A':
-            v = 1
-        elif card in ['J', 'Q', 'K']:
-            v = 10
-        else:
-            v = int(card)
-        
-        return v
+        return CARD_VALUES[card]
     
     def calc_points(self):
         '''
@@ -44,46 +60,36 @@ class Gamer():
                 - total_point:       the maximal points of the current cards.
                 - special_ace_exists: whethere there is a Ace regarded as 11
         '''
-        special_ace_num = 0
-        total_point = 0
-        if self.cards is None:
-            return 0, False
-        
-        for c in self.cards:
-            v = self._card_value(c)
-            ## ace will be preferentially regarded as 11 (special ace)
-            if v == 1:
-                special_ace_num += 1
-                v = 11
-            total_point += v
-        
-        ## check if any ace can be reduced to 1 (normal ace) if point > 21 ##
-        while total_point > 21 and special_ace_num > 0:
-            total_point -= 10
-            special_ace_num -= 1
-        
-        special_ace_exists = (special_ace_num != 0)
-        
-        return total_point, special_ace_exists
+        ## at most one ace can be regarded as 11 (special ace) ##
+        if self.hard <= MAX_HARD:
+            return POINTS[self.hard][self.aces > 0]
+        return self.hard, False
     
     def receive_cards(self, cards = []):
         '''
-            Receive new cards.
+            Receive new cards given by their codes.
         '''
-        cards = list(cards)
-        self.cards.extend(cards)
+        for c in cards:
+            if not self.cards:
+                self.first_card_value = CARD_VALUES[c]
+            self.cards.append(c)
+            self.hard += CARD_VALUES[c]
+            self.aces += (c == ACE)
     
     def discharge_cards(self):
         '''
             Discharged cards when game overs.
         '''
         self.cards.clear() 
+        self.hard, self.aces, self.first_card_value = 0, 0, 0
     
     def cards_info(self):
         '''
             Show the cards in hand.
         '''
-        self._info("{}.{}'s cards are:{}\n".format(self.role, self.name, self.cards))
+        if self.display:
+            self._info("{}.{}'s cards are:{}\n".format(self.role, self.name,
+                [CARD_NAMES[c] for c in self.cards]))
 
 
 class Dealer(Gamer):
@@ -92,9 +98,7 @@ class Dealer(Gamer):
         self.role = "Dealer"
     
     def show_first_card(self):
-        if self.cards is None or len(self.cards) == 0:
-            return 0
-        return self._card_value(self.cards[0])
+        return self.first_card_value
     
     def policy(self):
         points, _ = self.calc_points()
@@ -112,13 +116,22 @@ class Player(Gamer):
         self.learning_method = None
     
     def get_state(self, dealer):
-        dealer_first_card = dealer.show_first_card()
-        points, special_ace_exists = self.calc_points()
-        return (dealer_first_card, points, special_ace_exists)
+        if self.hard <= MAX_HARD:
+            return STATES[dealer.show_first_card()][self.hard][self.aces > 0]
+        return (dealer.show_first_card(),) + self.calc_points()
     
     def get_state_name(self, dealer):
         return utils.str_key(self.get_state(dealer))
     
+    def get_state_index(self, dealer):
+        '''
+            The state as an integer index into arrays shaped [11, 32, 2, ...]
+            (dealer_first_card, points, special_ace_exists) flattened over
+            the first three axes, see np.unravel_index(s, STATE_SHAPE).
+        '''
+        ## any hand over MAX_HARD is busted, they share the last row ##
+        return STATE_INDICES[dealer.show_first_card()][min(self.hard, MAX_HARD)][self.aces > 0]
+    
     def policy(self):
         points, _ = self.calc_points()
         if points < 20:
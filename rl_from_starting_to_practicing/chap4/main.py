@@ -1,18 +1,23 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
+import numpy as np
 import env
-import utils
 import gamer
 
 def policy_evaluate(episodes, V, Ns):
-    for episode, r in episodes:
-        for s, a in episode:
-            ns = utils.get_dict(Ns, s)
-            v = utils.get_dict(V, s)
-            utils.set_dict(Ns, ns+1, s)
-            ## using r instead of G_t is because this is a one-step game
-            utils.set_dict(V, v+(r-v)/(ns+1), s)
+    '''
+        Every-visit MC evaluation, V and Ns are arrays shaped [11, 32, 2]
+        updated in place with all the episodes at once.
+    '''
+    states = [s for episode, r in episodes for s, a in episode]
+    ## using r instead of G_t is because this is a one-step game
+    returns = [r for episode, r in episodes for s, a in episode]
+    v, ns = V.reshape(-1), Ns.reshape(-1)
+    total = v * ns
+    np.add.at(ns, states, 1)
+    np.add.at(total, states, returns)
+    np.divide(total, ns, out=v, where=ns > 0)
 
 if __name__ == '__main__':
     display = False
@@ -24,6 +29,6 @@ if __name__ == '__main__':
     
     arena.repeat_game(dealer, player, num=200000)
     
-    V = {} ## value function
-    Ns = {} ## visiting time counter
+    V = np.zeros(gamer.STATE_SHAPE) ## value function
+    Ns = np.zeros(gamer.STATE_SHAPE, dtype=np.int64) ## visiting time counter
     policy_evaluate(arena.episodes, V, Ns)
\ No newline at end of file
@@ -2,9 +2,95 @@
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
 import utils
-import random
+import numpy as np
 from tqdm import tqdm
-from queue import Queue
+
+## a card is coded by its index in CARD_NAMES, a deck has 4 cards of each ##
+CARD_NAMES = ['A','2','3','4','5','6','7','8','9','J','Q','K']
+## point value of each card code (A=1, JQK=10) ##
+CARD_VALUES = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10])
+ACE = 0
+
+## (total_point, special_ace_exists) of a hand indexed by [hard total][has ace],
+## the hard total counting every ace as 1; beyond the table no ace can be 11 ##
+MAX_HARD = 31
+POINTS = [[(hard, False), (hard + 10, True) if hard + 10 <= 21 else (hard, False)]
+          for hard in range(MAX_HARD + 1)]
+## the player state (dealer_first_card, total_point, special_ace_exists)
+## indexed by [dealer_first_card][hard total][has ace] ##
+STATES = [[[(dealer_card,) + POINTS[hard][has_ace] for has_ace in range(2)]
+           for hard in range(MAX_HARD + 1)] for dealer_card in range(11)]
+## the same state as a flat index into arrays shaped [11, 32, 2, ...] ##
+STATE_SHAPE = (11, 32, 2)
+STATE_INDICES = [[[(d * 32 + p) * 2 + u for d, p, u in by_ace] for by_ace in by_hard]
+                 for by_hard in STATES]
+_CARD_VALUES = CARD_VALUES.tolist()
+
+
+class Shoe():
+    '''
+        A shoe of 'n_decks' decks kept as a shuffled array of card codes and a
+        cursor: dealing 'n' cards is a slice. Cards are returned in bulk with
+        'recycle'; once the cursor passes 'penetration' of the shoe, or too few
+        cards are left, the returned and the undealt cards are shuffled
+        together while the cards still in hand stay out.
+        With 'infinite' every card, the first ones included, is drawn
+        independently from one deck; the draws are made in blocks of at least
+        'block' cards.
+    '''
+    def __init__(self, n_decks=1, penetration=1.0, infinite=False, seed=None,
+                 block=4096):
+        self.rng = np.random.default_rng(seed)
+        self.infinite = infinite
+        self.penetration = penetration
+        self.block = block
+        ## cards[:discarded] are returned, cards[discarded:cursor] are in hand ##
+        self.discarded = 0
+        self.cursor = 0
+        if infinite:
+            self.reshuffle()
+        else:
+            self.cards = np.tile(np.arange(len(CARD_NAMES)), 4 * n_decks)
+            self.rng.shuffle(self.cards)
+    
+    def __len__(self):
+        return len(self.cards) - self.cursor
+    
+    def reshuffle(self, n=0):
+        '''
+            Refill the shoe so that at least 'n' cards can be dealt.
+        '''
+        if self.infinite:
+            self.cards = self.rng.integers(len(CARD_NAMES), size=max(self.block, n))
+            self.discarded, self.cursor = 0, 0
+            return
+        in_hand = self.cards[self.discarded:self.cursor]
+        rest = np.concatenate([self.cards[:self.discarded], self.cards[self.cursor:]])
+        self.rng.shuffle(rest)
+        self.cards = np.concatenate([in_hand, rest])
+        self.discarded, self.cursor = 0, len(in_hand)
+        if len(rest) < n:
+            raise(ValueError("cannot deal {} cards, {} are not in hand".format(
+                n, len(rest))))
+    
+    def deal(self, n=1):
+        '''
+            Deal the codes of 'n' cards.
+        '''
+        if self.cursor + n > len(self.cards) or (not self.infinite and \
+           self.cursor >= self.penetration * len(self.cards)):
+            self.reshuffle(n)
+        cards = self.cards[self.cursor:self.cursor+n]
+        self.cursor += n
+        return cards
+    
+    def recycle(self, n):
+        '''
+            Return the 'n' earliest dealt cards that are still in hand.
+        '''
+        if not self.infinite:
+            self.discarded += n
+
 
 class Gamer():
     '''
@@ -19,6 +105,10 @@ class Gamer():
         self.action_set = ["Bid", "Stop"]
         
         self.cards = []
+        ## running state of the hand, updated as cards come ##
+        self.hard = 0               # total points with every ace as 1
+        self.aces = 0               # number of aces
+        self.first_card_value = 0
     
     def __str__(self):
         return self.name
@@ -29,16 +119,9 @@ class Gamer():
 
     def _card_value(self, card):
         '''
-            Get the value of a card: 2-9 go without saying; A is 1, JQK are 10
+            Get the value of a card code: 2-9 go without saying; A is 1, JQK are 10
         '''
-        if card == 'A':
-            v = 1
-        elif card in ['J', 'Q', 'K']:
-            v = 10
-        else:
-            v = int(card)
-        
-        return v
+        return _CARD_VALUES[card]
     
     def calc_points(self):
         '''
@@ -47,46 +130,36 @@ class Gamer():
                 - total_point:       the maximal points of the current cards.
                 - special_ace_exists: whethere there is a Ace regarded as 11
         '''
-        special_ace_num = 0
-        total_point = 0
-        if self.cards is None:
-            return 0, False
-        
-        for c in self.cards:
-            v = self._card_value(c)
-            ## ace will be preferentially regarded as 11 (special ace)
-            if v == 1:
-                special_ace_num += 1
-                v = 11
-            total_point += v
-        
-        ## check if any ace can be reduced to 1 (normal ace) if point > 21 ##
-        while total_point > 21 and special_ace_num > 0:
-            total_point -= 10
-            special_ace_num -= 1
-        
-        special_ace_exists = (special_ace_num != 0)
-        
-        return total_point, special_ace_exists
+        ## at most one ace can be regarded as 11 (special ace) ##
+        if self.hard <= MAX_HARD:
+            return POINTS[self.hard][self.aces > 0]
+        return self.hard, False
     
     def receive_cards(self, cards = []):
         '''
-            Receive new cards.
+            Receive new cards given by their codes.
         '''
-        cards = list(cards)
-        self.cards.extend(cards)
+        for c in cards:
+            if not self.cards:
+                self.first_card_value = _CARD_VALUES[c]
+            self.cards.append(c)
+            self.hard += _CARD_VALUES[c]
+            self.aces += (c == ACE)
     
     def discharge_cards(self):
         '''
             Discharged cards when game overs.
         '''
         self.cards.clear() 
+        self.hard, self.aces, self.first_card_value = 0, 0, 0
     
     def cards_info(self):
         '''
             Show the cards in hand.
         '''
-        self._info("{}.{}'s cards are:{}\n".format(self.role, self.name, self.cards))
+        if self.display:
+            self._info("{}.{}'s cards are:{}\n".format(self.role, self.name,
+                [CARD_NAMES[c] for c in self.cards]))
 
 
 class Dealer(Gamer):
@@ -95,9 +168,7 @@ class Dealer(Gamer):
         self.role = "Dealer"
     
     def show_first_card(self):
-        if self.cards is None or len(self.cards) == 0:
-            return 0
-        return self._card_value(self.cards[0])
+        return self.first_card_value
     
     def policy(self):
         points, _ = self.calc_points()
@@ -115,13 +186,22 @@ class Player(Gamer):
         self.learning_method = None
     
     def get_state(self, dealer):
-        dealer_first_card = dealer.show_first_card()
-        points, special_ace_exists = self.calc_points()
-        return (dealer_first_card, points, special_ace_exists)
+        if self.hard <= MAX_HARD:
+            return STATES[dealer.show_first_card()][self.hard][self.aces > 0]
+        return (dealer.show_first_card(),) + self.calc_points()
     
     def get_state_name(self, dealer):
         return utils.str_key(self.get_state(dealer))
     
+    def get_state_index(self, dealer):
+        '''
+            The state as an integer index into arrays shaped [11, 32, 2, ...]
+            (dealer_first_card, points, special_ace_exists) flattened over
+            the first three axes, see np.unravel_index(s, STATE_SHAPE).
+        '''
+        ## any hand over MAX_HARD is busted, they share the last row ##
+        return STATE_INDICES[dealer.show_first_card()][min(self.hard, MAX_HARD)][self.aces > 0]
+    
     def policy(self, dealer=None):
         points, _ = self.calc_points()
         if points < 20:
@@ -134,24 +214,13 @@ class Arena():
     '''
         A class to manage all the game.
     '''
-    def __init__(self, display=None):
-         self.cards = ['A','2','3','4','5','6','7','8','9','J','Q','K'] * 4
+    def __init__(self, display=None, n_decks=1, penetration=1.0, infinite=False,
+                 seed=None):
          self.action_set = ["Bid", "Stop"]
-         self.card_pool = Queue(maxsize=52)
-         self.discarded_cards = []
+         self.shoe = Shoe(n_decks, penetration, infinite, seed)
          
          self.display = display
          self.episodes = []
-         self.load_cards(self.cards)
-    
-    def load_cards(self, cards):
-        '''
-            Shuffle the cards and load them into the card pool.
-        '''
-        random.shuffle(cards)
-        for c in cards:
-            self.card_pool.put(c)
-        cards.clear()
     
     def give_reward(self, dealer, player):
         '''
@@ -175,23 +244,11 @@ class Arena():
     def serve_card(self, player, n=1):
         '''
             Deal 'n' cards to the 'player'.
-            Once there are insufficient cards in the pool, Arena will load cards
-        '''
-        cards = []
-        for _ in range(n):
-            if self.card_pool.empty(): ## no card in the pool ##
-                self._info("No card in the pool.")
-                random.shuffle(self.discarded_cards)
-                self._info("{} discarded cards are shuffed and loaded again.".format(
-                    len(self.discarded_cards)))
-                ## the players are not allowed to have too many cards in hand
-                ## which means when the card pool is empty, there must have
-                ## been enough cards be discarded.
-                assert(len(self.discarded_cards) > 20)
-                self.load_cards(self.discarded_cards)
-            cards.append(self.card_pool.get())
+            Once there are insufficient cards in the shoe, it gets reshuffled.
+        '''
+        cards = self.shoe.deal(n).tolist()
         self._info("Deal {} cards ({}) to {}.{}\n".format(
-            n, cards, player.role, player.name))
+            n, [CARD_NAMES[c] for c in cards], player.role, player.name))
         player.receive_cards(cards)
         player.cards_info()
         self._info("\n")
@@ -200,9 +257,9 @@ class Arena():
     def recycle_cards(self, *players):
         if len(players) == 0:
             return
+        ## all the hands of a game are recycled together, oldest cards first ##
+        self.shoe.recycle(sum(len(p.cards) for p in players))
         for p in players:
-            for c in p.cards:
-                self.discarded_cards.append(c)
             p.discharge_cards()
     
     def play_game(self, dealer, player):
@@ -218,7 +275,8 @@ class Arena():
             player_action = player.policy(dealer)
             self._info("{}.{} decides to: {}\n".format(
                 player.role, player.name, player_action))
-            episode.append((player.get_state_name(dealer), player_action))
+            episode.append((player.get_state_index(dealer),
+                            0 if player_action == self.action_set[0] else 1))
             if player_action == self.action_set[0]:
                 self.serve_card(player)
             else:
@@ -288,4 +346,123 @@ class Arena():
     
     def _info(self, message):
         if self.display:
-            print(message, end="")
\ No newline at end of file
+            print(message, end="")
+
+
+class VectorArena():
+    '''
+        Play 'n' games at the same time with NumPy arrays, following the rules
+        of Arena.play_game. A hand is kept as its hard total (every ace counts
+        1) and its number of aces, cards are drawn from an infinite deck with
+        the composition of Arena's deck and the dealer hits below 17.
+    '''
+    def __init__(self, seed=None):
+        self.action_set = ["Bid", "Stop"]
+        self.rng = np.random.default_rng(seed)
+    
+    def deal(self, n):
+        '''
+            Draw the values of 'n' cards.
+        '''
+        return CARD_VALUES[self.rng.integers(len(CARD_NAMES), size=n)]
+    
+    @staticmethod
+    def points(hard, aces):
+        '''
+            Same as Gamer.calc_points: (total_point, special_ace_exists) of
+            hands given by their hard totals and ace counts.
+        '''
+        special_ace_exists = (aces > 0) & (hard + 10 <= 21)
+        return hard + 10 * special_ace_exists, special_ace_exists
+    
+    @staticmethod
+    def threshold_policy(threshold=20):
+        '''
+            Table of the probability to bid, indexed by [dealer_first_card,
+            player_points, special_ace_exists], for the policy that bids
+            below 'threshold' points (the policy of Player).
+        '''
+        table = np.zeros((11, 32, 2))
+        table[:, :threshold] = 1.0
+        return table
+    
+    def play_games(self, n, policy=20):
+        '''
+            Play 'n' games.
+            Args:
+                - policy: a threshold for threshold_policy, or a table of the
+                  probability to bid shaped [11, 32, 2]. A busted player
+                  always stops.
+            Return:
+                - index:   the game each decision belongs to, shape [M]
+                - states:  (dealer_first_card, player_points,
+                           special_ace_exists) of each decision, shape [M, 3]
+                - actions: index in action_set of each decision, shape [M]
+                - rewards: the reward of each game, shape [n]
+            decisions are grouped by game and in time order within a game.
+        '''
+        if isinstance(policy, int):
+            policy = self.threshold_policy(policy)
+        bid_prob = np.asarray(policy)
+        
+        cards = self.deal(4 * n).reshape(4, n)
+        hard = cards[0] + cards[1]
+        aces = (cards[0] == 1).astype(np.int64) + (cards[1] == 1)
+        dealer_hard = cards[2] + cards[3]
+        dealer_aces = (cards[2] == 1).astype(np.int64) + (cards[3] == 1)
+        dealer_first_card = cards[2]
+        
+        ## the player decides until stopping, only bidding hands stay active ##
+        steps = []
+        active = np.arange(n)
+        while len(active) > 0:
+            player_points, special_ace = self.points(hard[active], aces[active])
+            p = bid_prob[dealer_first_card[active], player_points, special_ace.astype(np.int64)]
+            bid = (self.rng.random(len(active)) < p) & (player_points <= 21)
+            steps.append((active, dealer_first_card[active], player_points,
+                          special_ace, (~bid).astype(np.int64)))
+            active = active[bid]
+            card = self.deal(len(active))
+            hard[active] += card
+            aces[active] += card == 1
+        player_points, _ = self.points(hard, aces)
+        
+        ## the dealer plays only against players who do not bust ##
+        active = np.flatnonzero(player_points <= 21)
+        while len(active) > 0:
+            dealer_points, _ = self.points(dealer_hard[active], dealer_aces[active])
+            active = active[dealer_points < 17]
+            card = self.deal(len(active))
+            dealer_hard[active] += card
+            dealer_aces[active] += card == 1
+        dealer_points, _ = self.points(dealer_hard, dealer_aces)
+        
+        rewards = np.where(player_points > 21, -1,
+                  np.where((player_points > dealer_points) | (dealer_points > 21), 1,
+                  np.where(player_points == dealer_points, 0, -1)))
+        
+        ## the k-th decision of a game goes to start[game] + k ##
+        counts = np.zeros(n, dtype=np.int64)
+        for step in steps:
+            counts[step[0]] += 1
+        start = np.cumsum(counts) - counts
+        index = np.repeat(np.arange(n), counts)
+        states = np.empty((len(index), 3), dtype=np.int64)
+        actions = np.empty(len(index), dtype=np.int64)
+        for k, (games, dealer_card, points, special_ace, action) in enumerate(steps):
+            at = start[games] + k
+            states[at, 0], states[at, 1], states[at, 2] = dealer_card, points, special_ace
+            actions[at] = action
+        return index, states, actions, rewards
+
+
+if __name__ == '__main__':
+    import time
+    
+    arena = VectorArena(seed=0)
+    start = time.perf_counter()
+    index, states, actions, rewards = arena.play_games(1000000)
+    elapsed = time.perf_counter() - start
+    print("1000000 games in {:.2f}s, {} decisions".format(elapsed, len(index)))
+    print("The player won/drew/lost for {}/{}/{} rounds".format(
+        np.sum(rewards == 1), np.sum(rewards == 0), np.sum(rewards == -1)))
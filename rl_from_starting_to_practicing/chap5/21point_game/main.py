@@ -2,8 +2,13 @@
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
 import math
+import random
+import numpy as np
 import utils
-from blackjack import Player, Dealer, Arena
+from blackjack import Player, Dealer, Arena, STATE_SHAPE
+
+## greedy action indexed by sign(Q(s, Stop) - Q(s, Bid)): tie, Stop, Bid (-1) ##
+_GREEDY = np.array([-1, 1, 0])
 
 class MC_Player(Player):
     '''
@@ -11,8 +16,15 @@ class MC_Player(Player):
     '''
     def __init__(self, name="", display=False):
         super().__init__(name, display)
-        self.Q = {} ## Q function
-        self.Nsa = {} ## (s, a) pair counter
+        ## indexed by [dealer_first_card, points, special_ace_exists, action] ##
+        self.Q = np.zeros(STATE_SHAPE + (2,)) ## Q function
+        self.Nsa = np.zeros(STATE_SHAPE + (2,), dtype=np.int64) ## (s, a) pair counter
+        ## greedy action of each state, -1 if both actions have the same value ##
+        self.greedy = np.full(STATE_SHAPE, -1, dtype=np.int64)
+        ## views indexed by the flat state index of get_state_index ##
+        self._q = self.Q.reshape(-1, 2)
+        self._n = self.Nsa.reshape(-1, 2)
+        self._greedy = self.greedy.reshape(-1)
         self.total_learning_times = 0
         self.learning_method = self.learn_Q
     
@@ -20,19 +32,37 @@ class MC_Player(Player):
         '''
             Study with a collected episode.
         '''
-        for s, a in episode:
-            nsa = utils.get_dict(self.Nsa, s, a)
-            utils.set_dict(self.Nsa, nsa+1, s, a)
-            q = utils.get_dict(self.Q, s, a)
-            utils.set_dict(self.Q, q + (reward-q)/(nsa+1), s, a)
+        s, a = np.array(episode).T
+        np.add.at(self._n, (s, a), 1)
+        np.add.at(self._q, (s, a), (reward - self._q[s, a]) / self._n[s, a])
+        self.update_greedy(s)
         self.total_learning_times += 1
-        
+    
+    def merge(self, counts, sums, n_games=0):
+        '''
+            Merge the visit counts and return sums of (s, a) pairs collected
+            in 'n_games' games played elsewhere, both shaped like Q.
+        '''
+        total = self.Q * self.Nsa + sums
+        self.Nsa += counts
+        np.divide(total, self.Nsa, out=self.Q, where=self.Nsa > 0)
+        self.update_greedy()
+        self.total_learning_times += n_games
+
+    def update_greedy(self, s=slice(None)):
+        '''
+            Refresh the greedy action of the given flat states, all by default.
+        '''
+        q = self._q[s]
+        self._greedy[s] = _GREEDY[np.sign(q[:, 1] - q[:, 0]).astype(np.int64)]
+    
     def reset_momery(self):
         '''
             Clear the experience learned.
         '''
-        self.Q.clear()
-        self.Nsa.clear()
+        self.Q[...] = 0
+        self.Nsa[...] = 0
+        self.greedy[...] = -1
         self.total_learning_times = 0
     
     def policy(self, dealer, epsilon=None):
@@ -45,10 +75,14 @@ class MC_Player(Player):
         if player_points < 12:
             return self.action_set[0]
         else:
-            s = self.get_state_name(dealer)
             if epsilon is None:
                 epsilon = 1.0/(1 + 4*math.log10(1+self.total_learning_times))
-            return utils.epsilon_greedy_policy(self.action_set, s, self.Q, epsilon)
+            a = -1
+            if random.random() >= epsilon:
+                a = self._greedy[self.get_state_index(dealer)]
+            if a < 0:
+                return random.choice(self.action_set)
+            return self.action_set[a]
 
 if __name__ == '__main__':
     display = False
@@ -59,8 +93,6 @@ if __name__ == '__main__':
     
     arena.repeat_game(dealer, player, num=200000)
     
-    utils.draw_policy(utils.epsilon_greedy_policy, player.action_set, player.Q,
-                      epsilon=1e-10, special_ace_exists=False)
+    utils.draw_policy(player.Q, special_ace_exists=False)
     
-    utils.draw_policy(utils.epsilon_greedy_policy, player.action_set, player.Q,
-                      epsilon=1e-10, special_ace_exists=True)
\ No newline at end of file
+    utils.draw_policy(player.Q, special_ace_exists=True)
\ No newline at end of file
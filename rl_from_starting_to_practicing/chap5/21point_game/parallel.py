@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+
+'''
+    Multi-process MC control self-play for the MC_Player.
+    Every worker owns an Arena (so its own shoe), a Dealer and an MC_Player,
+    seeded from its own stream of one SeedSequence. A round starts with the
+    learner's greedy table broadcast in 'multiprocessing.shared_memory'; each
+    worker plays its chunk of games ε-greedily against it and writes back the
+    visit counts and return sums of every (state, action). The coordinator
+    merges them into the learner's Q/Nsa. Both are integers, so the merged
+    statistics do not depend on the order the workers finish in.
+    If a worker dies during a round its games are lost, so repeat_game raises
+    rather than merging a partial round or waiting for the missing counts.
+'''
+import time
+import random
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from blackjack import Arena, Dealer, STATE_SHAPE
+from main import MC_Player
+
+## control[0] at the start of a round: quit, or play the chunk of games ##
+_STOP, _PLAY = 0, 1
+
+
+def _share(array):
+    '''
+        Put one of the round arrays (greedy table, counts, sums, control) in
+        shared memory, returns the block and a view of it.
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, view
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker(worker_id, seed, arena_kwargs, specs, start_barrier, done_barrier):
+    '''
+        Play 'chunks[worker_id]' games per round until told to stop.
+    '''
+    try:
+        _play(worker_id, seed, arena_kwargs, specs, start_barrier, done_barrier)
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        ## the round cannot complete without this worker's games ##
+        start_barrier.abort()
+        done_barrier.abort()
+        raise
+
+
+def _play(worker_id, seed, arena_kwargs, specs, start_barrier, done_barrier):
+    random.seed(seed)
+    np.random.seed(seed)
+    ## the views below live as long as this worker, so must the blocks ##
+    shms, arrays = [], {}
+    for key, spec in specs.items():
+        shm, arrays[key] = _attach(spec)
+        shms.append(shm)
+    control, chunks, results = arrays["control"], arrays["chunks"], arrays["results"]
+    counts = arrays["counts"][worker_id].reshape(-1, 2)
+    sums = arrays["sums"][worker_id].reshape(-1, 2)
+
+    arena = Arena(seed=seed, **arena_kwargs)
+    dealer = Dealer(name="God")
+    player = MC_Player(name="Elio")
+    player.learning_method = None
+    ## act on the broadcast greedy table instead of a private one ##
+    player.greedy = arrays["greedy"]
+    player._greedy = player.greedy.reshape(-1)
+
+    while True:
+        start_barrier.wait()
+        command, n_workers, learned = (int(c) for c in control)
+        if command == _STOP:
+            break
+        arena.episodes.clear()
+        results[worker_id] = 0
+        for i in range(chunks[worker_id]):
+            ## ε decays with the games played by all the workers so far ##
+            player.total_learning_times = learned + i * n_workers
+            _, reward = arena.play_game(dealer, player)
+            results[worker_id, 1+reward] += 1
+        s, a = np.array([sa for episode, _ in arena.episodes for sa in episode],
+                        dtype=np.int64).reshape(-1, 2).T
+        r = [reward for episode, reward in arena.episodes for _ in episode]
+        counts[...] = 0
+        sums[...] = 0
+        np.add.at(counts, (s, a), 1)
+        np.add.at(sums, (s, a), r)
+        done_barrier.wait()
+
+
+class ParallelArena():
+    '''
+        Play MC control games on 'n_workers' processes (defaults to the number
+        of cores) for an MC_Player living in this process.
+        The same 'seed', 'n_workers' and 'sync_every' give the same learner;
+        with seed None every run differs. Arena options such as 'n_decks' are
+        passed to the arena of each worker. If the workers have not delivered
+        a round's statistics after 'timeout' seconds they are assumed stuck.
+    '''
+    def __init__(self, n_workers=None, seed=None, timeout=600, **arena_kwargs):
+        self.n_workers = n_workers or mp.cpu_count()
+        self.timeout = timeout
+        self.stats = {}
+        Arena(**arena_kwargs)   ## fail here on bad options, not in every worker ##
+        shape = (self.n_workers,) + STATE_SHAPE + (2,)
+
+        self._shms, self._arrays, specs = [], {}, {}
+        for key, array in [("greedy", np.full(STATE_SHAPE, -1, dtype=np.int64)),
+                           ("counts", np.zeros(shape, dtype=np.int64)),
+                           ("sums", np.zeros(shape, dtype=np.int64)),
+                           ("chunks", np.zeros(self.n_workers, dtype=np.int64)),
+                           ("results", np.zeros((self.n_workers, 3), dtype=np.int64)),
+                           ("control", np.zeros(3, dtype=np.int64))]:
+            shm, view = _share(array)
+            self._shms.append(shm)
+            self._arrays[key] = view
+            specs[key] = (shm.name, view.shape, view.dtype)
+
+        seeds = [int(s.generate_state(1)[0])
+                 for s in np.random.SeedSequence(seed).spawn(self.n_workers)]
+        self._start_barrier = mp.Barrier(self.n_workers + 1)
+        self._done_barrier = mp.Barrier(self.n_workers + 1)
+        self._workers = []
+        for i in range(self.n_workers):
+            w = mp.Process(target=_worker,
+                           args=(i, seeds[i], arena_kwargs, specs,
+                                 self._start_barrier, self._done_barrier),
+                           daemon=True)
+            w.start()
+            self._workers.append(w)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _wait(self, barrier):
+        '''
+            Meet the workers at the start or the end of a round. A dead
+            worker, an aborted round or the timeout ends this arena.
+        '''
+        try:
+            ## idle workers sit inside start_barrier.wait(); if one of them was
+            ## killed there, the barrier could never be released or aborted ##
+            if not all(w.is_alive() for w in self._workers):
+                raise(threading.BrokenBarrierError)
+            barrier.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            exitcodes = self._terminate()
+            dead = [i for i, code in enumerate(exitcodes) if code not in (None, 0)]
+            if dead:
+                raise(Exception("Blackjack worker {} died (exit code {}), its games"
+                                " are lost".format(dead[0], exitcodes[dead[0]]))) from None
+            raise(Exception("no game statistics from the workers after {}s".format(
+                self.timeout))) from None
+
+    def _terminate(self):
+        '''
+            Shut down every worker of this arena, returns the exit codes seen
+            before any straggler is killed (None for the stragglers).
+        '''
+        exitcodes = []
+        for w in self._workers:
+            w.join(1)
+            exitcodes.append(w.exitcode)
+            if w.is_alive():
+                w.terminate()
+                w.join()
+        self._workers = []
+        return exitcodes
+
+    def _round(self, player, num):
+        '''
+            Broadcast the greedy table of 'player', play 'num' games across
+            the workers and merge what they saw into 'player'.
+        '''
+        if not self._workers:
+            raise(Exception("this arena's workers have been shut down"))
+        arrays = self._arrays
+        chunks = np.full(self.n_workers, num // self.n_workers)
+        chunks[:num % self.n_workers] += 1
+        arrays["chunks"][...] = chunks
+        arrays["greedy"][...] = player.greedy
+        arrays["control"][...] = _PLAY, self.n_workers, player.total_learning_times
+        self._wait(self._start_barrier)
+        self._wait(self._done_barrier)
+        player.merge(arrays["counts"].sum(axis=0), arrays["sums"].sum(axis=0), num)
+        return arrays["results"].sum(axis=0)
+
+    def repeat_game(self, player, num=2, sync_every=None, show_statistic=True):
+        '''
+            Play 'num' games and merge their statistics into 'player'.
+            The workers follow the greedy table of 'player' as it was at the
+            start of the call, refreshed every 'sync_every' games if given
+            (on-policy control needs it, a fixed policy does not).
+        '''
+        sync_every = sync_every or num
+        results = np.zeros(3, dtype=np.int64)
+        start = time.perf_counter()
+        for played in range(0, num, sync_every):
+            results += self._round(player, min(sync_every, num - played))
+        elapsed = time.perf_counter() - start
+        self.stats = {"workers": self.n_workers, "games": num, "time": elapsed,
+                      "games_per_second": num / elapsed if elapsed > 0 else 0.0}
+
+        if show_statistic:
+            print("Total {} rounds: The player won/drew/lost for {}/{}/{} rounds".format(
+                num, results[2], results[1], results[0]))
+            ## drew is regarded as 1/2 win ##
+            print("Winning percentage: {:.2f}%".format(
+                ((results[2] + 0.5*results[1])/num) * 100))
+        return results
+
+    def close(self):
+        '''
+            Send the workers home and free the greedy table and statistics
+            blocks, even if a worker has to be killed on the way.
+        '''
+        try:
+            if self._workers:
+                self._arrays["control"][0] = _STOP
+                self._wait(self._start_barrier)
+                for w in self._workers:
+                    w.join()
+                self._workers = []
+        finally:
+            self._arrays.clear()
+            for shm in self._shms:
+                shm.close()
+                shm.unlink()
+            self._shms = []
+
+
+if __name__ == '__main__':
+    num = 200000
+
+    player = MC_Player(name="Elio")
+    start = time.perf_counter()
+    Arena(seed=0).repeat_game(Dealer(name="God"), player, num=num)
+    print("1 process : {:.0f} games/s".format(num / (time.perf_counter() - start)))
+
+    player = MC_Player(name="Elio")
+    with ParallelArena(seed=0) as arena:
+        arena.repeat_game(player, num=num, sync_every=10000)
+        print("{} processes: {:.0f} games/s".format(
+            arena.n_workers, arena.stats["games_per_second"]))
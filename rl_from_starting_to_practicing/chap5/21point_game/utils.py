@@ -23,20 +23,14 @@ def set_dict(target_dict, value, *args):
 def get_dict(target_dict, *args):
     return target_dict.get(str_key(*args),0)
 
-def draw_policy(policy, A, Q, epsilon, special_ace_exists=False):
-    def value_of(a):
-        return 0 if a == A[0] else 1
-
-    rows, cols = 11, 10
-    Z = np.zeros((rows, cols))
-    dealer_first_card = np.arange(1, 12)
-    play_points = np.arange(12, 22)
-    for i in range(11, 22):
-        for j in range(1, 11):
-            s = j, i, special_ace_exists
-            s = str_key(s)
-            a = policy(A, s, Q, epsilon)
-            Z[i-11,j-1] = value_of(a)
+def draw_policy(Q, special_ace_exists=False):
+    '''画出Q（形状为[11, 32, 2, 2]的数组）对应的贪婪策略，
+    两个行为价值相同时随机选择一个。
+    '''
+    ## rows: player points 11..21, cols: dealer first card 1..10 ##
+    q = Q[1:11, 11:22, int(special_ace_exists)].transpose(1, 0, 2)
+    tie = np.random.randint(2, size=q.shape[:2])
+    Z = np.where(q[..., 0] == q[..., 1], tie, q[..., 1] > q[..., 0])
     
     plt.imshow(Z, cmap=plt.cm.cool, interpolation=None, origin="lower",
                extent=[0.5,11.5,10.5,21.5])
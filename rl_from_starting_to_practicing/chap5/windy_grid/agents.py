@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
+import heapq
 import utils
+import numpy as np
 from gym import Env
 from core import Agent
+from gridworld import VectorGridWorld
 
 class SarsaAgent(Agent):
-    def __init__(self, env: Env = None, capacity=10000):
-        super().__init__(env, capacity)
-        self.Q = {}
+    def __init__(self, env: Env = None, capacity=10000, experience=None):
+        super().__init__(env, capacity, experience)
+        self.Q = utils.QTable(self.obs_space, self.action_space)
     
     def policy(self, A, s, Q, epsilon):
         return utils.epsilon_greedy_policy(A, s, Q, epsilon)
@@ -27,11 +30,9 @@ class SarsaAgent(Agent):
                 self.env.render()
             a1 = self.perform_policy(s1, self.Q, epsilon)
             
-            old_Q = utils.get_dict(self.Q, s0, a0)
-            Q_next = utils.get_dict(self.Q, s1, a1)
-            td_target = r1 + gamma * Q_next
-            new_Q = old_Q + alpha * (td_target - old_Q)
-            utils.set_dict(self.Q, new_Q, s0, a0)
+            old_Q = self.Q[s0, a0]
+            td_target = r1 + gamma * self.Q[s1, a1]
+            self.Q[s0, a0] = old_Q + alpha * (td_target - old_Q)
             
             s0, a0 = s1, a1
             time_in_episode += 1
@@ -43,9 +44,14 @@ class SarsaAgent(Agent):
 
 
 class SarsaLambdaAgent(Agent):
-    def __init__(self, env: Env = None, capacity=10000):
-        super().__init__(env, capacity)
-        self.Q = {}
+    def __init__(self, env: Env = None, capacity=10000, trace_mode='accumulating',
+                 trace_threshold=1e-4, experience=None):
+        super().__init__(env, capacity, experience)
+        self.Q = utils.QTable(self.obs_space, self.action_space)
+        ## 资格迹只对稠密的Q表做向量化更新 ##
+        assert self.Q.dense, "SarsaLambdaAgent needs Discrete spaces"
+        self.E = utils.EligibilityTrace(self.action_space.n, mode=trace_mode,
+                                        threshold=trace_threshold)
     
     def policy(self, A, s, Q, epsilon):
         return utils.epsilon_greedy_policy(A, s, Q, epsilon)
@@ -57,7 +63,9 @@ class SarsaLambdaAgent(Agent):
         a0 = self.perform_policy(s0, self.Q, epsilon)
         time_in_episode, total_reward = 0, 0
         is_done = False
-        E = {}
+        E = self.E
+        E.clear()
+        Q = self.Q.table.reshape(-1)
         
         while not is_done:
             s1, r1, is_done, info, total_reward = self.act(a0)
@@ -65,22 +73,12 @@ class SarsaLambdaAgent(Agent):
                 self.env.render()
             a1 = self.perform_policy(s1, self.Q, epsilon)
             
-            q = utils.get_dict(self.Q, s0, a0)
-            q_next = utils.get_dict(self.Q, s1, a1)
-            delta = r1 + gamma * q_next - q
+            delta = r1 + gamma * self.Q[s1, a1] - self.Q[s0, a0]
             
-            e = utils.get_dict(E, s0, a0)
-            e += 1
-            utils.set_dict(E, e, s0, a0)
-            
-            for s in self.S:
-                for a in self.A:
-                    e_value = utils.get_dict(E, s, a)
-                    old_Q = utils.get_dict(self.Q, s, a)
-                    new_Q = old_Q + alpha * delta * e_value
-                    new_e = gamma * lambda_ * e_value
-                    utils.set_dict(self.Q, new_Q, s, a)
-                    utils.set_dict(E, new_e, s, a)
+            E.visit(s0, a0, alpha)
+            ## 只更新资格迹非零的(s, a) ##
+            Q[E.indices] += alpha * delta * E.values
+            E.decay(gamma * lambda_)
             
             s0, a0 = s1, a1
             time_in_episode += 1
@@ -92,9 +90,9 @@ class SarsaLambdaAgent(Agent):
 
 
 class QAgent(Agent):
-    def __init__(self, env: Env = None, capacity=10000):
-        super().__init__(env, capacity)
-        self.Q = {}
+    def __init__(self, env: Env = None, capacity=10000, experience=None):
+        super().__init__(env, capacity, experience)
+        self.Q = utils.QTable(self.obs_space, self.action_space)
     
     def policy(self, A, s, Q, epsilon):
         return utils.epsilon_greedy_policy(A, s, Q, epsilon)
@@ -113,11 +111,9 @@ class QAgent(Agent):
                 self.env.render()
             a1 = utils.greedy_policy(self.A, s1, self.Q) ## off-line policy ##
             
-            old_Q = utils.get_dict(self.Q, s0, a0)
-            Q_next = utils.get_dict(self.Q, s1, a1)
-            td_target = r1 + gamma * Q_next
-            new_Q = old_Q + alpha * (td_target - old_Q)
-            utils.set_dict(self.Q, new_Q, s0, a0)
+            old_Q = self.Q[s0, a0]
+            td_target = r1 + gamma * self.Q[s1, a1]
+            self.Q[s0, a0] = old_Q + alpha * (td_target - old_Q)
             
             s0 = s1
             time_in_episode += 1
@@ -125,4 +121,208 @@ class QAgent(Agent):
         if show:
             print(self.experience.last_episode)
         
-        return time_in_episode, total_reward
\ No newline at end of file
+        return time_in_episode, total_reward
+
+
+class DynaQAgent(Agent):
+    '''基于模型的Q学习。个体在与环境交互的同时把观测到的(s, a)的后继状态、
+    奖励和是否结束记在模型表中（确定性环境，后观测到的覆盖先前的），
+    每个真实的时间步之后再用模型做n_planning次模拟的Q学习更新：
+        - prioritized = False: 从观测过的(s, a)中均匀随机选取 (Dyna-Q)
+        - prioritized = True:  按TD误差从优先队列中选取，更新某状态后通过
+          前驱索引把能到达它的(s, a)重新加入队列 (prioritized sweeping)
+    '''
+    def __init__(self, env: Env = None, capacity=10000, n_planning=10,
+                 prioritized=False, theta=1e-4, experience=None):
+        super().__init__(env, capacity, experience)
+        self.Q = utils.QTable(self.obs_space, self.action_space)
+        assert self.Q.dense, "DynaQAgent needs Discrete spaces"
+        self.n_planning = n_planning
+        self.prioritized = prioritized
+        self.theta = theta
+        n_states, n_actions = self.Q.table.shape
+        ## 模型表，以s*n_actions+a索引，-1表示没有观测过 ##
+        self.model_next = np.full(n_states * n_actions, -1, dtype=np.int64)
+        self.model_reward = np.zeros(n_states * n_actions)
+        self.model_done = np.zeros(n_states * n_actions, dtype=bool)
+        self.observed = []                                  # 观测过的(s, a)
+        self.predecessors = [[] for _ in range(n_states)]  # 能到达某状态的(s, a)
+        self.priority = [0.0] * (n_states * n_actions)      # 队列中(s, a)的当前优先级
+        self.queue = []
+        self.planning_backups = 0
+    
+    def policy(self, A, s, Q, epsilon):
+        return utils.epsilon_greedy_policy(A, s, Q, epsilon)
+
+    def _update_model(self, s0, a0, r1, is_done, s1):
+        index = s0 * len(self.A) + a0
+        if self.model_next[index] < 0:
+            self.observed.append(index)
+        if self.model_next[index] != s1:
+            self.predecessors[s1].append(index)
+        self.model_next[index] = s1
+        self.model_reward[index] = r1
+        self.model_done[index] = is_done
+    
+    def _td_error(self, index, gamma, v1 = None):
+        '''模型给出的(s, a)的TD误差，v1是后继状态的最大Q值，没有给出时现算
+        '''
+        if v1 is None:
+            v1 = self.Q.table[self.model_next[index]].max()
+        td_target = self.model_reward.item(index)
+        if not self.model_done[index]:
+            td_target += gamma * v1
+        return float(td_target - self.Q.table.item(index))
+    
+    def _push(self, index, gamma, v1 = None):
+        error = abs(self._td_error(index, gamma, v1))
+        if error > self.theta:
+            self.priority[index] = error
+            heapq.heappush(self.queue, (-error, index))
+    
+    def planning(self, gamma, alpha):
+        '''用模型做至多n_planning次模拟的Q学习更新
+        '''
+        Q = self.Q.table.reshape(-1)
+        n_actions = len(self.A)
+        if not self.prioritized:
+            picks = np.random.randint(len(self.observed), size=self.n_planning)
+            for index in picks.tolist():
+                Q[self.observed[index]] += alpha * self._td_error(self.observed[index], gamma)
+            self.planning_backups += self.n_planning
+            return
+        ## 优先队列中过期的项直接跳过 ##
+        n = 0
+        while self.queue and n < self.n_planning:
+            neg_error, index = heapq.heappop(self.queue)
+            if -neg_error != self.priority[index]:
+                continue
+            self.priority[index] = 0.0
+            Q[index] += alpha * self._td_error(index, gamma)
+            n += 1
+            ## 前驱的TD目标都用到s的最大Q值，只需算一次 ##
+            s = index // n_actions
+            v1 = self.Q.table[s].max()
+            for p in self.predecessors[s]:
+                if self.model_next[p] == s:
+                    self._push(p, gamma, v1)
+        self.planning_backups += n
+
+    def learning_method(self, gamma=0.9, alpha=0.1, epsilon=1e-5, display=False,
+                        lambda_ = None, show=False):
+        self.state = self.env.reset()
+        s0 = self.state
+        time_in_episode, total_reward = 0, 0
+        is_done = False
+        
+        while not is_done:
+            a0 = self.perform_policy(s0, self.Q, epsilon)
+            s1, r1, is_done, info, total_reward = self.act(a0)
+            if display:
+                self.env.render()
+            self._update_model(s0, a0, r1, is_done, s1)
+            index = s0 * len(self.A) + a0
+            if self.prioritized:
+                self._push(index, gamma)
+            else:
+                a1 = utils.greedy_policy(self.A, s1, self.Q) ## off-line policy ##
+                old_Q = self.Q[s0, a0]
+                td_target = r1 + gamma * self.Q[s1, a1]
+                self.Q[s0, a0] = old_Q + alpha * (td_target - old_Q)
+            self.planning(gamma, alpha)
+            
+            s0 = s1
+            time_in_episode += 1
+        
+        if show:
+            print(self.experience.last_episode)
+        
+        return time_in_episode, total_reward
+
+
+class VectorAgent(object):
+    '''在VectorGridWorld上批量学习的表格型agent的基类，
+    Q是形状为[n_states, n_actions]的数组，每一步对N个副本同时做N次TD更新。
+    子类(VectorSarsaAgent、VectorQAgent)提供learning_step(gamma, alpha, epsilon)：
+    所有副本各走一步并更新Q，返回venv.step的info。
+    '''
+    def __init__(self, venv: VectorGridWorld = None, Q = None, seed = None):
+        self.venv = venv
+        self.Q = np.zeros((venv.n_states, venv.n_actions)) if Q is None else Q
+        self.rng = np.random.default_rng(seed)
+    
+    def policy(self, states, epsilon):
+        '''批量的ε-greedy策略，价值相同的行为随机选取
+        '''
+        q = self.Q[states]
+        is_max = (q == q.max(axis=1, keepdims=True))
+        actions = np.argmax(is_max * self.rng.random(q.shape), axis=1)
+        explore = self.rng.random(len(states)) < epsilon
+        actions[explore] = self.rng.integers(q.shape[1], size=explore.sum())
+        return actions
+    
+    def _td_update(self, s0, a0, td_target, alpha):
+        ## 同一(s, a)在一批中出现多次时取各次TD误差的平均，避免步长被放大 ##
+        index = s0 * self.Q.shape[1] + a0
+        delta = td_target - self.Q.flat[index]
+        updated, inverse, count = np.unique(index, return_inverse=True,
+                                            return_counts=True)
+        delta_sum = np.bincount(inverse, weights=delta)
+        self.Q.flat[updated] += alpha * delta_sum / count
+    
+    def learning(self, gamma=0.9, alpha=0.1, epsilon=None, decaying_epsilon=True,
+                 max_episode_num=800):
+        '''所有副本一起学习，直到结束的episode总数达到max_episode_num。
+        返回值与Agent.learning相同：(累计步数, 每个episode的奖励, episode序号)
+        ε的取法也与Agent.learning相同，只是以所有副本已结束的episode数n代替episode序号：
+        decaying_epsilon时ε = 1/(1+n)；epsilon为None时第一个episode结束前ε = 1e-10，
+        之后若decaying_epsilon则同样按1/(1+n)衰减，否则保持1e-10。
+        '''
+        total_time, num_episode = 0, 0
+        total_times, episode_rewards, num_episodes = [], [], []
+        self.start_learning()
+        while num_episode < max_episode_num:
+            if epsilon is None and (num_episode == 0 or not decaying_epsilon):
+                _epsilon = 1e-10
+            elif decaying_epsilon:
+                _epsilon = 1.0 / (1 + num_episode)
+            else:
+                _epsilon = epsilon
+            info = self.learning_step(gamma, alpha, _epsilon)
+            total_time += self.venv.n_envs
+            for r in info["episode_rewards"]:
+                num_episode += 1
+                total_times.append(total_time)
+                episode_rewards.append(r)
+                num_episodes.append(num_episode)
+        return total_times, episode_rewards, num_episodes
+    
+    def start_learning(self):
+        self.states = self.venv.reset()
+
+
+class VectorSarsaAgent(VectorAgent):
+    def start_learning(self):
+        super().start_learning()
+        self.actions = None
+    
+    def learning_step(self, gamma, alpha, epsilon):
+        s0 = self.states
+        a0 = self.policy(s0, epsilon) if self.actions is None else self.actions
+        s1, r1, is_done, info = self.venv.step(a0)
+        a1 = self.policy(s1, epsilon)
+        td_target = r1 + gamma * self.Q[s1, a1] * ~is_done
+        self._td_update(s0, a0, td_target, alpha)
+        self.states, self.actions = s1, a1
+        return info
+
+
+class VectorQAgent(VectorAgent):
+    def learning_step(self, gamma, alpha, epsilon):
+        s0 = self.states
+        a0 = self.policy(s0, epsilon)
+        s1, r1, is_done, info = self.venv.step(a0)
+        td_target = r1 + gamma * self.Q[s1].max(axis=1) * ~is_done
+        self._td_update(s0, a0, td_target, alpha)
+        self.states = s1
+        return info
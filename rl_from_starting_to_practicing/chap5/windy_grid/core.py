@@ -12,6 +12,8 @@ import numpy as np
 from collections import namedtuple
 from typing import List
 import random
+import queue
+import threading
 from tqdm import tqdm
 
 
@@ -101,14 +103,26 @@ class Episode(object):
 
 class Experience(object):
     '''this class is used to record the whole experience of an agent organized
-    by an episode list. agent can randomly sample transitions or episodes from
+    by episodes. agent can randomly sample transitions or episodes from
     its experience.
+    transitions are stored in a circular buffer of columnar arrays (s0, a0,
+    reward, is_done, s1) and episodes are described by their boundaries in
+    another circular buffer, so that both push and eviction cost O(1).
     '''
     def __init__(self, capacity:int = 20000):
         self.capacity = capacity    # 容量：指的是trans总数量
-        self.episodes = []          # episode列表
-        self.next_id = 0            # 下一个episode的Id
+        self.next_id = 0            # 下一个episode的Id，也是episode的全局序号
         self.total_trans = 0        # 总的状态转换数量
+        self._next_trans = 0        # 下一个trans的全局序号
+        self._first_id = 0          # 最早的一个episode的Id
+        # 各列在第一次push时根据数据的形状和类型分配
+        self._s0, self._a0, self._s1 = None, None, None
+        self._reward = np.zeros(max(capacity, 0), dtype=np.float64)
+        self._is_done = np.zeros(max(capacity, 0), dtype=bool)
+        # episode边界：起始trans的全局序号、长度、总奖励
+        self._ep_start = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._ep_len = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._ep_reward = np.zeros(max(capacity, 0), dtype=np.float64)
         
     def __str__(self):
         return "exp info:{0:5} episodes, memory usage {1}/{2}".\
@@ -119,45 +133,80 @@ class Experience(object):
 
     @property
     def len(self):
-        return len(self.episodes)
-
-    def _remove(self, index = 0):      
-        '''扔掉一个Episode，默认第一个。
-           remove an episode, defautly the first one.
-           args: 
-               the index of the episode to remove
-           return:
-               if exists return the episode else return None
+        return self.next_id - self._first_id
+
+    @property
+    def episodes(self):
+        '''所有episode，按需从缓冲区中生成
         '''
-        if index > self.len - 1:
-            raise(Exception("invalid index"))
-        if self.len > 0:
-            episode = self.episodes[index]
-            self.episodes.remove(episode)
-            self.total_trans -= episode.len
-            return episode
-        else:
-            return None
+        return [self._episode(e_id) for e_id in range(self._first_id, self.next_id)]
+
+    def _allocate(self, s0, a0):
+        s0, a0 = np.asarray(s0), np.asarray(a0)
+        self._s0 = np.zeros((self.capacity,) + s0.shape, dtype=s0.dtype)
+        self._s1 = np.zeros((self.capacity,) + s0.shape, dtype=s0.dtype)
+        self._a0 = np.zeros((self.capacity,) + a0.shape, dtype=a0.dtype)
 
     def _remove_first(self):
-        self._remove(index = 0)
+        '''扔掉最早的一个Episode。
+           remove the first (oldest) episode.
+        '''
+        if self.len > 0:
+            self.total_trans -= self._ep_len[self._first_id % self.capacity]
+            self._first_id += 1
+
+    def _last_complete(self):
+        if self.len == 0:
+            return True
+        slot = (self.next_id - 1) % self.capacity
+        last = self._ep_start[slot] + self._ep_len[slot] - 1
+        return bool(self._is_done[last % self.capacity])
 
     def push(self, trans): 
         '''压入一个状态转换
         '''
         if self.capacity <= 0:
             return
-        while self.total_trans >= self.capacity: # 可能会有空episode吗？
-            episode = self._remove_first()
-        cur_episode = None
-        if self.len == 0 or self.episodes[self.len-1].is_complete():
-            cur_episode = Episode(self.next_id)
+        s0, a0, reward, is_done, s1 = trans
+        if self._s0 is None:
+            self._allocate(s0, a0)
+        while self.total_trans >= self.capacity:
+            self._remove_first()
+        if self._last_complete():
+            slot = self.next_id % self.capacity
+            self._ep_start[slot] = self._next_trans
+            self._ep_len[slot] = 0
+            self._ep_reward[slot] = 0
             self.next_id += 1
-            self.episodes.append(cur_episode)
-        else:
-            cur_episode = self.episodes[self.len-1]
+        
+        i = self._next_trans % self.capacity
+        self._s0[i], self._a0[i], self._s1[i] = s0, a0, s1
+        self._reward[i], self._is_done[i] = reward, is_done
+        self._next_trans += 1
         self.total_trans += 1
-        return cur_episode.push(trans)      #return  total reward of an episode
+        
+        slot = (self.next_id - 1) % self.capacity
+        self._ep_len[slot] += 1
+        self._ep_reward[slot] += reward
+        return self._ep_reward[slot].item()     #return  total reward of an episode
+
+    def _transition(self, i):
+        i = i % self.capacity
+        s0, a0, s1 = self._s0[i], self._a0[i], self._s1[i]
+        if s0.ndim == 0:
+            s0, s1 = s0.item(), s1.item()
+        else:
+            s0, s1 = s0.copy(), s1.copy()
+        a0 = a0.item() if a0.ndim == 0 else a0.copy()
+        return Transition(s0, a0, self._reward[i].item(), bool(self._is_done[i]), s1)
+
+    def _episode(self, e_id):
+        slot = e_id % self.capacity
+        episode = Episode(e_id)
+        start = self._ep_start[slot]
+        for i in range(start, start + self._ep_len[slot]):
+            episode.push(self._transition(i))
+        return episode
 
     def sample(self, batch_size=1): # sample transition
         '''randomly sample some transitions from agent's experience.abs
@@ -167,37 +216,251 @@ class Experience(object):
         return:
             list of Transition.
         '''
-        sample_trans = []
-        for _ in range(batch_size):
-            index = int(random.random() * self.len)
-            sample_trans += self.episodes[index].sample()
-        return sample_trans
+        # 先随机选择episode，再在episode内随机选择trans
+        slots = (self._first_id + np.random.randint(self.len, size=batch_size)) \
+                % self.capacity
+        offsets = (np.random.random(batch_size) * self._ep_len[slots]).astype(np.int64)
+        return [self._transition(i) for i in self._ep_start[slots] + offsets]
+
+    def sample_batch(self, batch_size=128, replace=True):
+        '''在所有trans上均匀随机取样，一次性得到整批数据
+        args:
+            batch_size: number of transitions need to be sampled
+            replace: whether a transition can be drawn more than once
+        return:
+            contiguous arrays (s0, a0, reward, is_done, s1), each with
+            batch_size rows.
+        '''
+        first = self._ep_start[self._first_id % self.capacity]
+        if replace:
+            offsets = np.random.randint(self.total_trans, size=batch_size)
+        else:
+            offsets = np.random.choice(self.total_trans, size=batch_size,
+                                       replace=False)
+        i = (first + offsets) % self.capacity
+        return self._s0[i], self._a0[i], self._reward[i], self._is_done[i], \
+               self._s1[i]
 
     def sample_episode(self, episode_num = 1):  # sample episode
         '''随机获取一定数量完整的Episode
         '''
-        return random.sample(self.episodes, k = episode_num)
+        e_ids = random.sample(range(self._first_id, self.next_id), k = episode_num)
+        return [self._episode(e_id) for e_id in e_ids]
 
     @property
     def last_episode(self):
         if self.len > 0:
-            return self.episodes[self.len-1]
+            return self._episode(self.next_id - 1)
         return None
+
+    def close(self):
+        pass
     
 
 
+class EpisodeSummary(object):
+    '''只记录了长度和总奖励、没有保存状态转换的Episode
+    '''
+    def __init__(self, e_id:int, length:int, total_reward:float) -> None:
+        self.name = str(e_id)
+        self.len = length
+        self.total_reward = total_reward
+
+    def __str__(self):
+        return "episode {0:<4} {1:>4} steps,total reward:{2:<8.2f}".\
+            format(self.name, self.len,self.total_reward)
+
+    def print_detail(self):
+        print("detail of ({0}): transitions not recorded".format(self))
+
+    def __len__(self) -> int:
+        return self.len
+
+
+class NullExperience(object):
+    '''an experience sink that keeps nothing but the length and reward of the
+    current episode. used by agents that never replay their experience.
+    不保存任何状态转换，push的开销是常数
+    '''
+    def __init__(self):
+        self.capacity = 0
+        self.total_trans = 0        # 保存的状态转换数量，始终为0
+        self.next_id = 0            # 下一个episode的Id
+        self._ep_len = 0            # 当前episode的长度
+        self._ep_reward = 0.0       # 当前episode的总奖励
+        self._ep_done = True        # 当前episode是否已结束
+
+    def __str__(self):
+        return "exp info:{0:5} episodes, transitions not recorded".\
+                format(self.len)
+
+    def __len__(self):
+        return self.len
+
+    @property
+    def len(self):
+        return 0
+
+    def push(self, trans):
+        '''记录一个状态转换的奖励，返回当前episode的总奖励
+        '''
+        s0, a0, reward, is_done, s1 = trans
+        if self._ep_done:
+            self.next_id += 1
+            self._ep_len, self._ep_reward = 0, 0.0
+        self._ep_len += 1
+        self._ep_reward += reward
+        self._ep_done = is_done
+        if is_done:
+            self._end_episode()
+        return self._ep_reward
+
+    def _end_episode(self):
+        pass
+
+    def sample(self, batch_size = 1):
+        raise(Exception("transitions are not recorded"))
+
+    def sample_batch(self, batch_size = 128, replace = True):
+        raise(Exception("transitions are not recorded"))
+
+    def sample_episode(self, episode_num = 1):
+        raise(Exception("transitions are not recorded"))
+
+    @property
+    def last_episode(self):
+        if self.next_id > 0:
+            return EpisodeSummary(self.next_id - 1, self._ep_len, self._ep_reward)
+        return None
+
+    def close(self):
+        pass
+
+
+class SummaryExperience(NullExperience):
+    '''an experience sink that keeps the length and the total reward of every
+    finished episode, without any transition.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.episode_lengths = []   # 每个episode的长度
+        self.episode_rewards = []   # 每个episode的总奖励
+
+    @property
+    def len(self):
+        return len(self.episode_lengths)
+
+    def _end_episode(self):
+        self.episode_lengths.append(self._ep_len)
+        self.episode_rewards.append(self._ep_reward)
+
+
+class DiskExperience(SummaryExperience):
+    '''an experience sink that writes every transition to a binary log file.
+    transitions are buffered into chunks of structured arrays and a background
+    thread writes each chunk with np.save, so the file is a sequence of .npy
+    records that read_log can concatenate. an existing file at path is
+    overwritten, so a log always holds a single run. per-episode summaries are
+    kept in memory as in SummaryExperience. call close() (or Agent.close()) to
+    flush the last chunk.
+    '''
+    def __init__(self, path, chunk_size = 4096):
+        super().__init__()
+        self.path = path
+        self.chunk_size = chunk_size
+        self.total_logged = 0       # 写入日志的状态转换数量
+        self._pending = []          # 尚未打包的状态转换
+        self._dtype = None          # 第一次打包时根据数据确定
+        self._file = open(path, "wb")
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target = self._write, daemon = True)
+        self._writer.start()
+
+    def __str__(self):
+        return "exp info:{0:5} episodes, {1} transitions logged to {2}".\
+                format(self.len, self.total_logged, self.path)
+
+    def _write(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            np.save(self._file, chunk)
+        self._file.flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        if self._dtype is None:
+            s0, a0, _, _, _ = self._pending[0]
+            s0, a0 = np.asarray(s0), np.asarray(a0)
+            self._dtype = np.dtype([("s0", s0.dtype, s0.shape),
+                                    ("a0", a0.dtype, a0.shape),
+                                    ("reward", np.float64),
+                                    ("is_done", bool),
+                                    ("s1", s0.dtype, s0.shape)])
+        self._queue.put(np.array(self._pending, dtype = self._dtype))
+        self._pending = []
+
+    def push(self, trans):
+        total_reward = super().push(trans)
+        self._pending.append(tuple(trans))
+        self.total_logged += 1
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+        return total_reward
+
+    def close(self):
+        '''写出剩余的状态转换并关闭日志文件
+        '''
+        if self._writer is None:
+            return
+        self._flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._file.close()
+
+    @staticmethod
+    def read_log(path):
+        '''读取日志中所有的状态转换
+        return:
+            structured array with fields s0, a0, reward, is_done, s1.
+        '''
+        chunks = []
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    chunks.append(np.load(f))
+                except (EOFError, ValueError):
+                    break
+        return np.concatenate(chunks) if chunks else np.zeros(0)
+
+
 class Agent(object):
     '''Base Class of Agent
     '''
     def __init__(self, env: Env = None, 
-                       capacity = 10000):
+                       capacity = 10000,
+                       experience = None):
         # 保存一些Agent可以观测到的环境信息以及已经学到的经验
         self.env = env # 建立对环境对象的引用
         self.obs_space = env.observation_space if env is not None else None
         self.action_space = env.action_space if env is not None else None
         self.S = [i for i in range(self.obs_space.n)]
         self.A = [i for i in range(self.action_space.n)]
-        self.experience = Experience(capacity = capacity)
+        # 经验的保存方式："buffer"(默认，容量有限的内存缓冲区)、"summary"(只记录
+        # 每个episode的长度和奖励)、"none"(不记录)，或者一个DiskExperience等对象
+        if experience is None or experience == "buffer":
+            experience = Experience(capacity = capacity)
+        elif experience == "summary":
+            experience = SummaryExperience()
+        elif experience == "none":
+            experience = NullExperience()
+        elif isinstance(experience, str):
+            raise(ValueError("unknown experience: {}, expected "
+                             "'buffer', 'summary' or 'none'".format(experience)))
+        self.experience = experience
         # 有一个变量记录agent当前的state相对来说还是比较方便的。要注意对该变量的维护、更新
         self.state = None   # 个体的当前状态
     
@@ -214,8 +477,7 @@ class Agent(object):
         s0 = self.state
         s1, r1, is_done, info = self.env.step(a0)
         # TODO add extra code here
-        trans = Transition(s0, a0, r1, is_done, s1)
-        total_reward = self.experience.push(trans)
+        total_reward = self.experience.push((s0, a0, r1, is_done, s1))
         self.state = s1
         return s1, r1, is_done, info, total_reward
 
@@ -272,6 +534,11 @@ class Agent(object):
         '''
         return self.experience.sample(batch_size)
 
+    def sample_batch(self, batch_size = 128, replace = True):
+        '''均匀随机取样，返回数组(s0, a0, reward, is_done, s1)
+        '''
+        return self.experience.sample_batch(batch_size, replace)
+
     @property
     def total_trans(self):
         '''得到Experience里记录的总的状态转换数量
@@ -280,4 +547,15 @@ class Agent(object):
     
     def last_episode_detail(self):
         self.experience.last_episode.print_detail()
+
+    def close(self):
+        '''关闭经验的保存，DiskExperience此时写出最后一块数据
+        '''
+        self.experience.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
     
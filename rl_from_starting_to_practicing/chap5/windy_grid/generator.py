@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+
+'''
+    可复现的大规模格子世界生成器，用于性能测试。
+    迷宫、房间、随机障碍三种布局都直接以数组生成格子类型和奖励，
+    不经过逐个格子的set_type/set_reward，生成的是普通的GridWorldEnv。
+'''
+import time
+import numpy as np
+from gridworld import GridWorldEnv
+
+
+def _maze(n_width, n_height, rng):
+    '''二叉树算法生成的完美迷宫（任意两格之间恰有一条通路）：
+    偶数坐标的格子是通道节点，每个节点随机打通向右或向上的一堵墙，
+    最上一行只能向右、最右一列只能向上，因此所有节点连成一棵树。
+    '''
+    types = np.ones((n_height, n_width), dtype=np.int32)
+    types[0::2, 0::2] = 0
+    ny, nx = types[0::2, 0::2].shape
+    j, i = np.indices((ny, nx))
+    can_east, can_north = i < nx - 1, j < ny - 1
+    east = can_east & (~can_north | (rng.random((ny, nx)) < 0.5))
+    north = can_north & ~east
+    types[2*j[east], 2*i[east]+1] = 0
+    types[2*j[north]+1, 2*i[north]] = 0
+    return types
+
+
+def _rooms(n_width, n_height, room_size, rng):
+    '''边长为room_size的房间，相邻房间之间的墙上随机开一个门
+    '''
+    p = room_size + 1
+    y, x = np.indices((n_height, n_width))
+    types = ((x % p == room_size) | (y % p == room_size)).astype(np.int32)
+    ## 竖直的墙：第k道墙在x=k*p+room_size，每个房间行上开一个门 ##
+    walls = np.arange(room_size, n_width - 1, p)
+    rows = np.arange(0, n_height, p)
+    if len(walls) > 0:
+        heights = np.minimum(room_size, n_height - rows)
+        offsets = (rng.random((len(walls), len(rows))) * heights).astype(np.int64)
+        types[rows + offsets, walls[:, None]] = 0
+    ## 水平的墙 ##
+    walls = np.arange(room_size, n_height - 1, p)
+    cols = np.arange(0, n_width, p)
+    if len(walls) > 0:
+        widths = np.minimum(room_size, n_width - cols)
+        offsets = (rng.random((len(walls), len(cols))) * widths).astype(np.int64)
+        types[walls[:, None], cols + offsets] = 0
+    return types
+
+
+def _obstacles(n_width, n_height, obstacle_ratio, rng):
+    '''随机障碍，另外打通一条从左下角到右上角的随机阶梯形通路保证终点可达
+    '''
+    types = (rng.random((n_height, n_width)) < obstacle_ratio).astype(np.int32)
+    moves = rng.permutation(np.r_[np.zeros(n_width - 1, dtype=np.int64),
+                                  np.ones(n_height - 1, dtype=np.int64)])
+    xs = np.r_[0, np.cumsum(moves == 0)]
+    ys = np.r_[0, np.cumsum(moves == 1)]
+    types[ys, xs] = 0
+    return types
+
+
+def _wind(n_width, wind, rng):
+    '''wind可以是：列数k（随机选k列，风力1或2）、{列: 风力}字典或各列风力的序列
+    '''
+    if isinstance(wind, (int, np.integer)):
+        strength = np.zeros(n_width, dtype=np.int64)
+        cols = rng.choice(n_width, size=min(int(wind), n_width), replace=False)
+        strength[cols] = rng.integers(1, 3, size=len(cols))
+        return strength
+    if isinstance(wind, dict):
+        strength = np.zeros(n_width, dtype=np.int64)
+        strength[list(wind.keys())] = list(wind.values())
+        return strength
+    strength = np.asarray(wind, dtype=np.int64)
+    assert strength.shape == (n_width,), "wind needs one value per column"
+    return strength
+
+
+def ProceduralGridWorld(n_width = 100,
+                        n_height = 100,
+                        kind = "maze",
+                        seed = None,
+                        room_size = 8,
+                        obstacle_ratio = 0.2,
+                        wind = None,
+                        reward_cells = None,
+                        default_reward = -1.0,
+                        goal_reward = 0.0):
+    '''生成一个格子世界，同一个seed得到同一个世界。
+    args:
+        kind: "maze"迷宫、"rooms"房间、"obstacles"随机障碍
+        room_size: 房间的边长（kind="rooms"）
+        obstacle_ratio: 障碍格子的比例（kind="obstacles"）
+        wind: None表示无风，其余见_wind（有风时不保证终点可达）
+        reward_cells: {奖励: 格子数}，在随机的通道格子上设置特殊奖励
+        default_reward: 进入普通格子的奖励
+        goal_reward: 进入终点的奖励
+    return:
+        GridWorldEnv，起点是编号最小的通道格子，唯一的终点是编号最大的通道格子
+    '''
+    rng = np.random.default_rng(seed)
+    if kind == "maze":
+        types = _maze(n_width, n_height, rng)
+    elif kind == "rooms":
+        types = _rooms(n_width, n_height, room_size, rng)
+    elif kind == "obstacles":
+        types = _obstacles(n_width, n_height, obstacle_ratio, rng)
+    else:
+        raise(Exception("unknown kind of world: {}".format(kind)))
+    types = types.ravel()
+    free = np.flatnonzero(types == 0)
+    start, goal = int(free[0]), int(free[-1])
+
+    rewards = np.full(n_width * n_height, default_reward, dtype=np.float64)
+    rewards[goal] = goal_reward
+    if reward_cells:
+        candidates = free[(free != start) & (free != goal)]
+        counts = list(reward_cells.values())
+        cells = rng.choice(candidates, size=sum(counts), replace=False)
+        rewards[cells] = np.repeat(list(reward_cells.keys()), counts)
+
+    env = GridWorldEnv(n_width = n_width,
+                       n_height = n_height,
+                       u_size = max(1, min(40, 800 // max(n_width, n_height))),
+                       default_reward = default_reward,
+                       default_type = 0,
+                       windy = wind is not None)
+    if wind is not None:
+        env.wind = _wind(n_width, wind, rng)
+    env.start = (start % n_width, start // n_width)
+    env.ends = [(goal % n_width, goal // n_width)]
+    env.grids.types[:] = types
+    env.grids.rewards[:] = rewards
+    env.refresh_setting()
+    env.seed(seed)
+    env.reset()
+    return env
+
+
+if __name__ == '__main__':
+    from agents import VectorQAgent
+    from gridworld import VectorGridWorld
+
+    for kind in ["maze", "rooms", "obstacles"]:
+        start = time.perf_counter()
+        env = ProceduralGridWorld(1000, 1000, kind=kind, seed=0, wind=50,
+                                  reward_cells={-10: 1000, 10: 100})
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        V, Q = env.optimal_values(gamma=0.99, max_iter=100)
+        dp = time.perf_counter() - start
+        agent = VectorQAgent(VectorGridWorld(env, n_envs=256), seed=0)
+        agent.start_learning()
+        start = time.perf_counter()
+        for _ in range(100):
+            agent.learning_step(gamma=0.99, alpha=0.1, epsilon=0.1)
+        td = time.perf_counter() - start
+        print("{:<10} {} cells, {} walls: build {:.2f}s, 100 VI sweeps {:.2f}s, "
+              "100 batched TD steps {:.3f}s".format(kind, env.grids.len,
+              int(env.grids.types.sum()), build, dp, td))
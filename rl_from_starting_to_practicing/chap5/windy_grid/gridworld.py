@@ -42,8 +42,47 @@ class Grid(object):
                                                                    self.name
                                                                     )
 
+class GridView(Grid):
+    '''GridMatrix中某一个格子的视图，只在需要时才创建，
+    读写type、reward、value时直接作用于GridMatrix中的数组
+    '''
+    def __init__(self, matrix, x:int, y:int):
+        self._matrix = matrix
+        self._index = y * matrix.n_width + x
+        self.x = x
+        self.y = y
+        self.name = None
+        self._update_name()
+
+    @property
+    def type(self):
+        return self._matrix.types[self._index].item()
+
+    @type.setter
+    def type(self, type):
+        self._matrix.types[self._index] = type
+
+    @property
+    def reward(self):
+        return self._matrix.rewards[self._index].item()
+
+    @reward.setter
+    def reward(self, reward):
+        self._matrix.rewards[self._index] = reward
+
+    @property
+    def value(self):
+        return self._matrix.values[self._index].item()
+
+    @value.setter
+    def value(self, value):
+        self._matrix.values[self._index] = value
+
+
 class GridMatrix(object):
-    '''格子矩阵，通过不同的设置，模拟不同的格子世界环境
+    '''格子矩阵，通过不同的设置，模拟不同的格子世界环境。
+    格子的类型、奖励和价值分别保存在一维数组types、rewards、values中，
+    坐标(x,y)的格子位于索引y*n_width+x处。
     '''
     def __init__(self, n_width:int,                     # 水平方向格子数
                        n_height:int,                    # 竖直方向格子数
@@ -51,7 +90,9 @@ class GridMatrix(object):
                        default_reward: float = 0.0,     # 默认即时奖励值
                        default_value: float = 0.0       # 默认价值（这个有点多余）
                        ):
-        self.grids = None
+        self.types = None
+        self.rewards = None
+        self.values = None
         self.n_height = n_height
         self.n_width = n_width
         self.len = n_width * n_height
@@ -61,68 +102,73 @@ class GridMatrix(object):
         self.reset()
 
     def reset(self):
-        self.grids = []
-        for x in range(self.n_height):
-            for y in range(self.n_width):
-                self.grids.append(Grid(x, 
-                                       y, 
-                                       self.default_type, 
-                                       self.default_reward,
-                                       self.default_value))
-    
+        self.types = np.full(self.len, self.default_type, dtype=np.int32)
+        self.rewards = np.full(self.len, self.default_reward, dtype=np.float64)
+        self.values = np.full(self.len, self.default_value, dtype=np.float64)
+
+    @property
+    def grids(self):
+        '''所有格子的视图列表，按索引排列，每次访问时才创建
+        '''
+        return [self.get_grid(i % self.n_width, i // self.n_width)
+                for i in range(self.len)]
+
+    def _index(self, x, y=None):
+        '''坐标信息转换为数组中的索引
+        args: 坐标信息，由x,y表示或仅有一个类型为tuple的x表示
+        '''
+        if isinstance(x, tuple):
+            x, y = x[0], x[1]
+        assert(x>=0 and y>=0 and x < self.n_width and y < self.n_height),\
+                "任意坐标值应在合理区间"
+        return y * self.n_width + x
+
+    def _indices(self, xs, ys):
+        '''批量地将坐标转换为索引
+        '''
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        assert(np.all(xs>=0) and np.all(ys>=0) and np.all(xs < self.n_width) \
+               and np.all(ys < self.n_height)), "任意坐标值应在合理区间"
+        return ys * self.n_width + xs
+
     def get_grid(self, x, y=None):
         '''获取一个格子信息
         args: 坐标信息，由x,y表示或仅有一个类型为tuple的x表示
         return: grid object
         '''
-        xx, yy = None, None
-        if isinstance(x, int):
-            xx, yy = x, y
-        elif isinstance(x, tuple):
-            xx, yy = x[0], x[1]
-        assert(xx>=0 and yy>=0 and xx < self.n_width and yy < self.n_height),\
-                "任意坐标值应在合理区间"
-        index = yy * self.n_width + xx
-        return self.grids[index]
+        if isinstance(x, tuple):
+            x, y = x[0], x[1]
+        self._index(x, y)
+        return GridView(self, x, y)
 
     def set_reward(self, x, y, reward):
-        grid = self.get_grid(x,y)
-        if grid is not None:
-            grid.reward = reward
-        else:
-            raise("grid doesn't exist")
+        self.rewards[self._index(x, y)] = reward
 
     def set_value(self, x, y, value):
-        grid = self.get_grid(x,y)
-        if grid is not None:
-            grid.value = value
-        else:
-            raise("grid doesn't exist")
+        self.values[self._index(x, y)] = value
 
     def set_type(self, x, y, type):
-        grid = self.get_grid(x,y)
-        if grid is not None:
-            grid.type = type
-        else:
-            raise("grid doesn't exist")
+        self.types[self._index(x, y)] = type
+
+    def set_rewards(self, xs, ys, rewards):
+        '''批量设置格子的奖励，xs、ys、rewards为等长的序列（rewards也可以是标量）
+        '''
+        self.rewards[self._indices(xs, ys)] = rewards
+
+    def set_values(self, xs, ys, values):
+        self.values[self._indices(xs, ys)] = values
+
+    def set_types(self, xs, ys, types):
+        self.types[self._indices(xs, ys)] = types
 
     def get_reward(self, x, y):
-        grid = self.get_grid(x, y)
-        if grid is None:
-            return None
-        return grid.reward
+        return self.rewards[self._index(x, y)].item()
 
     def get_value(self, x, y):
-        grid = self.get_grid(x, y)
-        if grid is None:
-            return None
-        return grid.value
+        return self.values[self._index(x, y)].item()
 
     def get_type(self, x, y):
-        grid = self.get_grid(x, y)
-        if grid is None:
-            return None
-        return grid.type
+        return self.types[self._index(x, y)].item()
 
 
 class GridWorldEnv(gym.Env):
@@ -156,6 +202,7 @@ class GridWorldEnv(gym.Env):
         self.reward = 0         # for rendering
         self.action = None      # for rendering
         self.windy = windy      # 是否是有风格子世界
+        self.wind = None        # 各列的风力（向上推动的格数），None时使用默认的风
 
         # 0,1,2,3,4 represent left, right, up, down, -, five moves.
         self.action_space = spaces.Discrete(4)  
@@ -186,7 +233,9 @@ class GridWorldEnv(gym.Env):
 
     def _windy_effect(self, x, y):
         new_x, new_y = x, y
-        if self.windy:
+        if self.windy and self.wind is not None:
+            new_y += int(self.wind[new_x])
+        elif self.windy:
             if new_x in [3, 4, 5, 8]:
                 new_y += 1
             elif new_x in [6, 7]:
@@ -216,34 +265,41 @@ class GridWorldEnv(gym.Env):
         return new_x, new_y
         
     def step(self, action):
-        assert self.action_space.contains(action), \
+        # 动力学在refresh_setting()时已预先计算成表格，一步只需查表
+        index = self.state * self._n_actions + action
+        assert 0 <= action < self._n_actions, \
             "%r (%s) invalid" % (action, type(action))
         
         self.action = action    # action for rendering
-        old_x, old_y = self._state_to_xy(self.state)
-        new_x, new_y = old_x, old_y
-
-        # wind effect:
-        # 有风效果，其数字表示个体离开(而不是进入)该格子时朝向别的方向会被吹偏离的格子数
-        new_x, new_y = self._windy_effect(new_x, new_y)
-        # 行为效果
-        new_x, new_y = self._action_effect(new_x, new_y, action)
-        # boundary effect
-        new_x, new_y = self._boundary_effect(new_x, new_y)
-
-        # wall effect:
-        # 类型为1的格子为障碍格子，不可进入
-        if self.grids.get_type(new_x,new_y) == 1:
-            new_x, new_y = old_x, old_y
-
-        self.reward = self.grids.get_reward(new_x, new_y)
-
-        done = self._is_end_state(new_x, new_y) 
-        self.state = self._xy_to_state(new_x, new_y)
-        # 提供格子世界所有的信息在info内
-        info = {"x":new_x,"y":new_y, "grids":self.grids}
-        return self.state, self.reward, done, info
-    
+        self.state = int(self._next_state[index])
+        self.reward = float(self._reward[index])
+        done = bool(self._done[index])
+        return self.state, self.reward, done, {}
+
+    def _build_transition_table(self):
+        '''向量化地计算所有(状态, 行为)的下一状态、奖励以及是否终止。
+        风只与横坐标有关、行为效果只与行为有关，因此各自调用一次对应的效果函数
+        即可得到整张表。
+        return: (next_state, reward, done)，形状均为[n_states, n_actions]
+        '''
+        n_a = self.action_space.n
+        s = np.arange(self.n_width * self.n_height)
+        x, y = s % self.n_width, s // self.n_width
+        if self.windy and self.wind is not None:
+            wind = np.asarray(self.wind, dtype=np.int64)
+        else:
+            wind = np.array([self._windy_effect(xx, 0)[1] for xx in range(self.n_width)])
+        effect = np.array([self._action_effect(0, 0, a) for a in range(n_a)])
+        
+        new_x = np.clip(x[:, None] + effect[:, 0], 0, self.n_width - 1)
+        new_y = np.clip((y + wind[x])[:, None] + effect[:, 1], 0, self.n_height - 1)
+        next_state = new_y * self.n_width + new_x
+        # 障碍格子不可进入
+        next_state = np.where(self.grids.types[next_state] == 1, s[:, None], next_state)
+        
+        ends = [self._xy_to_state(end) for end in self.ends]
+        return next_state, self.grids.rewards[next_state], np.isin(next_state, ends)
+
     # 将状态变为横纵坐标
     def _state_to_xy(self, s):
         x = s % self.n_width
@@ -259,18 +315,62 @@ class GridWorldEnv(gym.Env):
         return -1        # 未知状态
 
     def refresh_setting(self):
-        '''用户在使用该类创建格子世界后可能会修改格子世界某些格子类型或奖励值
-        的设置，修改设置后通过调用该方法使得设置生效。
+        '''用户在使用该类创建格子世界后可能会修改格子世界某些格子类型、奖励值、
+        终止格子或行为空间的设置，修改设置后通过调用该方法使得设置生效。
+        该方法同时重建step使用的转移表。
         '''
-        for x,y,r in self.rewards:
-            self.grids.set_reward(x,y,r)
-        for x,y,t in self.types:
-            self.grids.set_type(x,y,t)
+        if len(self.rewards) > 0:
+            x, y, r = zip(*self.rewards)
+            self.grids.set_rewards(x, y, r)
+        if len(self.types) > 0:
+            x, y, t = zip(*self.types)
+            self.grids.set_types(x, y, t)
+        next_state, reward, done = self._build_transition_table()
+        self._background = None     # 设置改变后静态背景需要重新绘制
+        self._n_actions = next_state.shape[1]
+        self._next_state = next_state.astype(np.int64).ravel()
+        self._reward = reward.ravel()
+        self._done = done.ravel()
 
     def reset(self):
         self.state = self._xy_to_state(self.start)
         return self.state   
 
+    def transition_table(self):
+        '''确定性环境动力学的表格形式，即step所查的表（refresh_setting时生成，
+        包含子类的特殊效果，比如CliffWalk2的悬崖效果）。
+        return: (next_state, reward, done)，形状均为[n_states, n_actions]
+        '''
+        shape = (-1, self._n_actions)
+        return self._next_state.reshape(shape).copy(), \
+               self._reward.reshape(shape).copy(), \
+               self._done.reshape(shape).copy()
+
+    def optimal_values(self, gamma = 0.9, theta = 1e-8, max_iter = 10000):
+        '''基于transition_table用向量化的价值迭代求解最优价值，
+        终止状态及其之后的价值记为0。
+        args:
+            gamma: 衰减因子
+            theta: 两次迭代之间价值的最大变化小于theta时停止
+            max_iter: 最大迭代次数，gamma=1且存在无法到达终点的格子时需要它
+        return: (V, Q)，形状分别为[n_states]和[n_states, n_actions]
+        '''
+        next_state, reward, done = self.transition_table()
+        not_done = ~done
+        V = np.zeros(next_state.shape[0])
+        for _ in range(max_iter):
+            Q = reward + gamma * V[next_state] * not_done
+            V_new = Q.max(axis=1)
+            delta = np.max(np.abs(V_new - V))
+            V = V_new
+            if delta < theta:
+                break
+        Q = reward + gamma * V[next_state] * not_done
+        # 终止格子不会再产生行为，其价值按照agent的约定记为0
+        ends = [self._xy_to_state(end) for end in self.ends]
+        V[ends], Q[ends] = 0, 0
+        return V, Q
+
     # 判断是否是终止状态
     def _is_end_state(self, x, y=None):
         if y is not None:
@@ -285,6 +385,73 @@ class GridWorldEnv(gym.Env):
                 return True
         return False
 
+    def _cell_colors(self):
+        '''各格子的颜色，与render中的设置一致，形状为[n_height, n_width, 3]
+        '''
+        r = self.grids.rewards.reshape(self.n_height, self.n_width, 1) / 10
+        colors = np.where(r < 0, np.concatenate([0.9-r, 0.9+r, 0.9+r], axis=2),
+                 np.where(r > 0, np.concatenate([0.3+0*r, 0.5+r, 0.3+0*r], axis=2),
+                          1.0))
+        walls = self.grids.types.reshape(self.n_height, self.n_width) == 1
+        colors[walls] = 0.3
+        return np.clip(colors, 0, 1)
+
+    def _static_image(self):
+        '''把不随时间变化的格子（奖励、障碍、起点、终点）绘制成图像并缓存，
+        图像的第一行对应最上面（y最大）的格子。
+        '''
+        if self._background is not None:
+            return self._background
+        u = self.u_size
+        m = 2 if u >= 8 else 0              # 格子之间的间隙尺寸
+        w = min(3, max(1, u // 8))          # 边框宽度
+        colors = self._cell_colors()[::-1]
+        image = np.repeat(np.repeat(colors, u, axis=0), u, axis=1)
+        ## 间隙为黑色 ##
+        gap = np.ones(u, dtype=bool)
+        gap[m:u-m] = False
+        gap = np.tile(gap, max(self.n_width, self.n_height))
+        image[gap[:image.shape[0]], :] = 0
+        image[:, gap[:image.shape[1]]] = 0
+        ## 终点金黄色边框、起点蓝灰色边框 ##
+        ring = np.zeros((u, u), dtype=bool)
+        ring[m:u-m, m:u-m] = True
+        ring[m+w:u-m-w, m+w:u-m-w] = False
+        for (x, y), color in [(end, (0.9, 0.9, 0)) for end in self.ends] + \
+                             [(self.start, (0.5, 0.5, 0.8))]:
+            row = (self.n_height - 1 - y) * u
+            image[row:row+u, x*u:(x+1)*u][ring] = color
+        self._background = (image * 255).astype(np.uint8)
+        ## 个体的圆形标记 ##
+        yy, xx = np.mgrid[0:u, 0:u] + 0.5
+        self._agent_mask = (xx - u/2)**2 + (yy - u/2)**2 <= (u/4)**2
+        return self._background
+
+    def render_frame(self, values = None, alpha = 0.6):
+        '''不依赖图形界面，直接生成当前画面的rgb数组[height, width, 3]。
+        静态背景只绘制一次，每一帧只叠加个体标记，以及可选的价值热图。
+        args:
+            values: 各状态的价值V[n_states]或Q值Q[n_states, n_actions]（取最大值），
+                    归一化后从蓝（低）到红（高）着色
+            alpha: 热图的不透明度
+        '''
+        frame = self._static_image().copy()
+        u = self.u_size
+        if values is not None:
+            v = np.asarray(values, dtype=np.float64)
+            if v.ndim == 2:
+                v = v.max(axis=1)
+            v = v.reshape(self.n_height, self.n_width)[::-1]
+            v = (v - v.min()) / (np.ptp(v) or 1.0)
+            heat = np.stack([v, 0.2 + 0*v, 1 - v], axis=2) * 255
+            heat = np.repeat(np.repeat(heat, u, axis=0), u, axis=1)
+            cells = frame.any(axis=2, keepdims=True)    # 不覆盖间隙
+            frame = np.where(cells, (1-alpha)*frame + alpha*heat, frame).astype(np.uint8)
+        x, y = self._state_to_xy(self.state)
+        row = (self.n_height - 1 - y) * u
+        frame[row:row+u, x*u:(x+1)*u][self._agent_mask] = (255, 255, 0)
+        return frame
+
     # 图形化界面
     def render(self, mode='human', close=False):
         if close:
@@ -292,6 +459,8 @@ class GridWorldEnv(gym.Env):
                 self.viewer.close()
                 self.viewer = None
             return
+        if mode == 'rgb_array':
+            return self.render_frame()
         zero = (0,0)
         u_size = self.u_size
         m = 2       # 格子之间的间隙尺寸
@@ -382,6 +551,43 @@ class GridWorldEnv(gym.Env):
         if self.viewer: self.viewer.close()
             
             
+class VectorGridWorld(object):
+    '''同一个格子世界的N个相互独立的副本，状态保存为整数数组，
+    所有副本共用环境的转移表，一次数组运算即可让所有副本同时走一步。
+    结束的副本会自动回到起点。
+    '''
+    def __init__(self, env:GridWorldEnv, n_envs:int = 64):
+        self.env = env
+        self.n_envs = n_envs
+        self.next_state, self.reward, self.done = env.transition_table()
+        self.n_states, self.n_actions = self.next_state.shape
+        self.start = env._xy_to_state(env.start)
+        self.reset()
+
+    def reset(self):
+        self.states = np.full(self.n_envs, self.start, dtype=np.int64)
+        self.episode_rewards = np.zeros(self.n_envs)    # 各副本当前episode的总奖励
+        self.episode_lengths = np.zeros(self.n_envs, dtype=np.int64)
+        return self.states.copy()
+
+    def step(self, actions):
+        '''所有副本同时执行actions
+        return: (states, rewards, dones, info)，结束的副本返回的是重置后的
+        起点状态；info中记录这一步结束的episode的总奖励和步数
+        '''
+        next_states = self.next_state[self.states, actions]
+        rewards = self.reward[self.states, actions]
+        dones = self.done[self.states, actions]
+        self.episode_rewards += rewards
+        self.episode_lengths += 1
+        info = {"episode_rewards": self.episode_rewards[dones],
+                "episode_lengths": self.episode_lengths[dones]}
+        self.episode_rewards[dones] = 0
+        self.episode_lengths[dones] = 0
+        self.states = np.where(dones, self.start, next_states)
+        return self.states.copy(), rewards, dones, info
+
+
 def LargeGridWorld():
     '''10*10的一个格子世界环境，设置参照：
     http://cs.stanford.edu/people/karpathy/reinforcejs/gridworld_td.html
@@ -487,37 +693,14 @@ class CliffWalk2(GridWorldEnv):
             #self.ends.append((i+1,0))
         self.refresh_setting()
 
-    def step(self, action):
-        assert self.action_space.contains(action), \
-            "%r (%s) invalid" % (action, type(action))
-        
-        self.action = action    # action for rendering
-        old_x, old_y = self._state_to_xy(self.state)
-        new_x, new_y = old_x, old_y
-
-        # wind effect:
-        # 有风效果，其数字表示个体离开(而不是进入)该格子时朝向别的方向会被吹偏离的格子数
-        new_x, new_y = self._windy_effect(new_x, new_y)
-        # 行为效果
-        new_x, new_y = self._action_effect(new_x, new_y, action)
-        # boundary effect
-        new_x, new_y = self._boundary_effect(new_x, new_y)
-
-        # wall effect:
-        # 类型为1的格子为障碍格子，不可进入
-        if self.grids.get_type(new_x,new_y) == 1:
-            new_x, new_y = old_x, old_y
-
-        self.reward = self.grids.get_reward(new_x, new_y)
-        # 悬崖效果
-        if 0 < new_x < 11 and new_y == 0:
-            new_x, new_y = 0, 0
-            
-        done = self._is_end_state(new_x, new_y) 
-        self.state = self._xy_to_state(new_x, new_y)
-        # 提供格子世界所有的信息在info内
-        info = {"x":new_x,"y":new_y, "grids":self.grids}
-        return self.state, self.reward, done, info
+    def _build_transition_table(self):
+        next_state, reward, done = super()._build_transition_table()
+        # 悬崖效果：掉下悬崖得到悬崖的奖励，但被送回(0,0)且回合不结束
+        x, y = next_state % self.n_width, next_state // self.n_width
+        cliff = (0 < x) & (x < 11) & (y == 0)
+        next_state[cliff] = self._xy_to_state(0, 0)
+        done[cliff] = self._is_end_state(0, 0)
+        return next_state, reward, done
     
         
         
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# _*_ coding: utf-8 _*_
+# Python version: 3.8
+
+'''
+    Hogwild式的多进程表格型学习：K个进程各自拥有一份环境和随机数种子，
+    用QAgent/SarsaAgent的学习方法，不加锁地更新同一张放在
+    multiprocessing.shared_memory中的Q表；主进程汇总各进程的episode统计。
+'''
+import time
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import utils
+from agents import QAgent, SarsaAgent
+
+
+def _share(array):
+    '''把array复制到一块新的共享内存中
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, view
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker(env, agent_class, seed, n_episodes, kwargs, q_spec, stats_spec, row):
+    '''在共享的Q表上学习n_episodes个episode，
+    把每个episode的步数和奖励写到统计数组的第row行
+    '''
+    random.seed(seed)
+    np.random.seed(seed)
+    q_shm, Q = _attach(q_spec)
+    stats_shm, stats = _attach(stats_spec)
+    agent = agent_class(env, experience="summary")
+    agent.Q.table = Q   ## 所有进程共用同一块内存，不加锁 ##
+    total_times, episode_rewards, _ = agent.learning(max_episode_num=n_episodes,
+                                                     **kwargs)
+    stats[row, :n_episodes, 0] = np.diff(total_times, prepend=0)
+    stats[row, :n_episodes, 1] = episode_rewards
+    del agent, Q, stats
+    q_shm.close()
+    stats_shm.close()
+
+
+class HogwildTrainer(object):
+    '''用n_workers个进程（默认是CPU核数）训练agent_class(QAgent或SarsaAgent)，
+    Q表放在共享内存中，可以像agent一样用Q[s, a]读取，也可以交给utils.show_q等函数。
+    seed为None时每次运行的结果不同，否则各进程的种子由seed派生。
+    '''
+    def __init__(self, env, agent_class = QAgent, n_workers = None, seed = None):
+        self.env = env
+        self.agent_class = agent_class
+        self.n_workers = n_workers or mp.cpu_count()
+        self._seeds = np.random.SeedSequence(seed)
+        self.Q = utils.QTable(env.observation_space, env.action_space)
+        assert self.Q.dense, "HogwildTrainer needs Discrete spaces"
+        self._shm, self.Q.table = _share(self.Q.table)
+        self.stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def learning(self, gamma = 0.9, alpha = 0.1, epsilon = None,
+                 decaying_epsilon = True, max_episode_num = 800):
+        '''各进程一共学习max_episode_num个episode，返回值与Agent.learning相同：
+        (累计步数, 每个episode的奖励, episode序号)，
+        各进程的episode按序号交替排列，近似于它们发生的先后顺序。
+        '''
+        counts = np.full(self.n_workers, max_episode_num // self.n_workers)
+        counts[:max_episode_num % self.n_workers] += 1
+        stats_shm, stats = _share(np.zeros((self.n_workers, counts.max(), 2)))
+        q_spec = (self._shm.name, self.Q.table.shape, self.Q.table.dtype)
+        stats_spec = (stats_shm.name, stats.shape, stats.dtype)
+        kwargs = dict(gamma = gamma, alpha = alpha, epsilon = epsilon,
+                      decaying_epsilon = decaying_epsilon)
+        seeds = [int(s.generate_state(1)[0]) for s in self._seeds.spawn(self.n_workers)]
+
+        start = time.perf_counter()
+        workers = []
+        for i in range(self.n_workers):
+            w = mp.Process(target = _worker,
+                           args = (self.env, self.agent_class, seeds[i], int(counts[i]),
+                                   kwargs, q_spec, stats_spec, i))
+            w.start()
+            workers.append(w)
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        if any(w.exitcode != 0 for w in workers):
+            stats_shm.close()
+            stats_shm.unlink()
+            raise(Exception("a worker exited abnormally"))
+
+        ## 按episode序号交替合并各进程的统计 ##
+        valid = np.arange(counts.max()) < counts[:, None]
+        lengths = stats[:, :, 0].T[valid.T]
+        rewards = stats[:, :, 1].T[valid.T]
+        self.stats = {"workers": self.n_workers, "time": elapsed,
+                      "steps": int(lengths.sum()),
+                      "episode_lengths": [stats[i, :counts[i], 0].astype(np.int64)
+                                          for i in range(self.n_workers)],
+                      "episode_rewards": [stats[i, :counts[i], 1].copy()
+                                          for i in range(self.n_workers)]}
+        del stats
+        stats_shm.close()
+        stats_shm.unlink()
+
+        total_times = np.cumsum(lengths).astype(np.int64).tolist()
+        return total_times, rewards.tolist(), list(range(1, len(rewards) + 1))
+
+    def close(self):
+        '''释放共享内存，Q表复制回进程内存
+        '''
+        if self._shm is not None:
+            self.Q.table = self.Q.table.copy()
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+if __name__ == '__main__':
+    from gridworld import CliffWalk, WindyGridWorld
+
+    for name, factory in [("CliffWalk", CliffWalk), ("WindyGridWorld", WindyGridWorld)]:
+        env = factory()
+        _, Q_star = env.optimal_values(gamma=1.0)
+        agent = QAgent(env, experience="summary")
+        start = time.perf_counter()
+        agent.learning(gamma=1.0, alpha=0.5, epsilon=0.1, decaying_epsilon=False,
+                       max_episode_num=4000)
+        print("{:<15} 1 process : {:.2f}s, q error {:.3f}".format(name,
+              time.perf_counter() - start, utils.q_error(agent, Q_star)))
+        with HogwildTrainer(env, QAgent, seed=0) as trainer:
+            trainer.learning(gamma=1.0, alpha=0.5, epsilon=0.1, decaying_epsilon=False,
+                             max_episode_num=4000)
+            print("{:<15} {} processes: {:.2f}s, q error {:.3f}".format(name,
+                  trainer.n_workers, trainer.stats["time"], utils.q_error(trainer, Q_star)))
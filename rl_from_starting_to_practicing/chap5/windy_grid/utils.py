@@ -4,6 +4,7 @@
 import random
 import numpy as np
 import matplotlib.pyplot as plt
+from gym import spaces
 
 def str_key(*args):
     '''将参数用"_"连接起来作为字典的键，需注意参数本身可能会是tuple或者list型，
@@ -23,13 +24,108 @@ def set_dict(target_dict, value, *args):
 def get_dict(target_dict, *args):
     return target_dict.get(str_key(*args),0)
 
+class QTable(object):
+    '''Q值表。观察空间和行为空间都是Discrete时，Q值保存在float32的稠密数组
+    table[n_states, n_actions]中，直接以整数(s, a)索引；否则自动退化为以
+    (s, a)为键的字典（稀疏存储），未出现过的(s, a)的Q值为0。
+    用法：Q[s, a]读取，Q[s, a] = value写入。
+    '''
+    def __init__(self, obs_space = None, action_space = None):
+        self.dense = isinstance(obs_space, spaces.Discrete) and \
+                     isinstance(action_space, spaces.Discrete)
+        if self.dense:
+            self.table = np.zeros((obs_space.n, action_space.n), dtype=np.float32)
+        else:
+            self.table = {}
+
+    @staticmethod
+    def _key(s, a):
+        # 数组形式的状态不能直接作为字典的键
+        if isinstance(s, np.ndarray):
+            s = tuple(s.tolist())
+        return s, a
+
+    def __getitem__(self, key):
+        s, a = key
+        if self.dense:
+            return self.table.item(s, a)
+        return self.table.get(self._key(s, a), 0.0)
+
+    def __setitem__(self, key, value):
+        s, a = key
+        if self.dense:
+            self.table[s, a] = value
+        else:
+            self.table[self._key(s, a)] = value
+
+    def row(self, s, A):
+        '''状态s下各行为的Q值列表，稠密存储时行为即为列的索引
+        '''
+        if self.dense:
+            return self.table[s].tolist()
+        return [self[s, a] for a in A]
+
+    def clear(self):
+        if self.dense:
+            self.table[...] = 0
+        else:
+            self.table.clear()
+
+class EligibilityTrace(object):
+    '''稀疏的资格迹，只保存非零项：indices为(s, a)在稠密Q表中的展开索引
+    s*n_actions+a，values为对应的资格迹。衰减后低于threshold的项被剪除，
+    因此每一步的开销只与资格迹的长度有关，而与状态空间的大小无关。
+    mode:
+        - accumulating: 访问时 e += 1
+        - replacing:    访问时 e = 1
+        - dutch:        访问时 e = (1-alpha)*e + 1
+    '''
+    def __init__(self, n_actions, mode = 'accumulating', threshold = 1e-4):
+        assert mode in ['accumulating', 'replacing', 'dutch'], \
+            "invalid trace mode: {}".format(mode)
+        self.n_actions = n_actions
+        self.mode = mode
+        self.threshold = threshold
+        self.clear()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def clear(self):
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float64)
+
+    def visit(self, s, a, alpha = None):
+        index = s * self.n_actions + a
+        pos = np.flatnonzero(self.indices == index)
+        if len(pos) == 0:
+            self.indices = np.append(self.indices, index)
+            self.values = np.append(self.values, 1.0)
+        elif self.mode == 'accumulating':
+            self.values[pos] += 1
+        elif self.mode == 'replacing':
+            self.values[pos] = 1
+        else:
+            self.values[pos] = (1 - alpha) * self.values[pos] + 1
+
+    def decay(self, factor):
+        '''所有资格迹乘以factor（即γλ），并剪除低于阈值的项
+        '''
+        self.values *= factor
+        keep = self.values >= self.threshold
+        if not keep.all():
+            self.indices, self.values = self.indices[keep], self.values[keep]
+
 def sample(A):
     return random.choice(A)
 
 def greedy_policy(A, s, Q, epsilon=None):
+    if isinstance(Q, QTable):
+        q_values = Q.row(s, A)
+    else:
+        q_values = [get_dict(Q, s, a_opt) for a_opt in A]
     max_q, a_max_q = -float('inf'), []
-    for a_opt in A:
-        q = get_dict(Q, s, a_opt)
+    for a_opt, q in zip(A, q_values):
         if q > max_q:
             max_q = q
             a_max_q = [a_opt]
@@ -75,21 +171,42 @@ def learning_curve(data, x_index = 0, y1_index = 1, y2_index = None, title = "",
     plt.show()
 
 def xy2state(x, y):
-    return str(y*12+x)
+    return y*12+x
 
 def str_key(s, a):
     '''根据横坐标，纵坐标和行为生成键
     '''
     return str(s)+"_"+str(a)
     
+def load_q(agent, Q):
+    '''把形状为[n_states, n_actions]的Q表（例如GridWorldEnv.optimal_values
+    给出的真实Q值）写入agent.Q，用来给SarsaAgent、QAgent等热启动
+    '''
+    if agent.Q.dense:
+        agent.Q.table[...] = Q
+        return
+    for s in range(Q.shape[0]):
+        for a in range(Q.shape[1]):
+            agent.Q[s, a] = Q[s, a]
+
+def q_error(agent, Q):
+    '''agent学到的Q值与参考Q表之间的最大绝对误差，用来评估学习效果
+    '''
+    if agent.Q.dense:
+        return float(np.max(np.abs(agent.Q.table - Q)))
+    error = 0.0
+    for s in range(Q.shape[0]):
+        for a in range(Q.shape[1]):
+            error = max(error, abs(agent.Q[s, a] - Q[s, a]))
+    return error
+    
 def print_q(agent):
     '''打印输出agent的价值
     '''
     for y in range(4):
         for x in range(12):
             for a in range(4):
-                key = str_key(xy2state(x,y),a)
-                print("{}_{}_{}:{}".format(x,y,a,agent.Q.get(key,0)))
+                print("{}_{}_{}:{}".format(x,y,a,agent.Q[xy2state(x,y),a]))
                 
 def show_q(agent):
     '''绘制agent学习得到的Q值，以图片的形式，每一个位置用3*3的小方格表示，
@@ -101,8 +218,7 @@ def show_q(agent):
         for x in range(12):
             max_qsa = -float('inf')
             for a in range(4): # 0-3 分别为 左 右 上 下
-                key = str_key(xy2state(x,y),a)
-                qsa = agent.Q.get(key,0)
+                qsa = agent.Q[xy2state(x,y),a]
                 if a == 0: V[3*y+1, 3*x+1-1] = qsa
                 if a == 1: V[3*y+1, 3*x+1+1] = qsa
                 if a == 2: V[3*y+1+1, 3*x+1] = qsa
@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 # _*_ coding: utf-8 _*_
 # Python version: 3.8
+import os
+import tempfile
 import gym
+import utils
 from gym import Env
 import matplotlib.pyplot as plt
 
-from core import Agent
+from core import Agent, DiskExperience
 from gridworld import WindyGridWorld
-from agents import SarsaAgent, SarsaLambdaAgent, QAgent
+from agents import SarsaAgent, SarsaLambdaAgent, QAgent, DynaQAgent
 
 if __name__ == '__main__':
     env = WindyGridWorld()
     env.reset()
+    ## ground-truth Q from dynamic programming, for benchmarking the agents ##
+    V_star, Q_star = env.optimal_values(gamma=1.0)
+    print("optimal value of the start state: {}".format(
+        V_star[env._xy_to_state(env.start)]))
     
     # agent = Agent(env, capacity=10000)
     # data = agent.learning(max_episode_num=180, display=False)
@@ -24,15 +31,32 @@ if __name__ == '__main__':
     statistics = agent.learning(lambda_=0.8, gamma=1.0, epsilon=0.2,\
         decaying_epsilon=True, alpha=0.5, max_episode_num=800, display=False,\
         show=True)
+    print("max |Q - Q*|: {:.3f}".format(utils.q_error(agent, Q_star)))
     print("-"*120)
     
     agent = SarsaLambdaAgent(env, capacity=100000)
     statistics = agent.learning(lambda_=0.8, gamma=1.0, epsilon=0.2,\
         decaying_epsilon=True, alpha=0.5, max_episode_num=800, display=False,\
         show=True)
+    print("max |Q - Q*|: {:.3f}".format(utils.q_error(agent, Q_star)))
     print("-"*120)
     
-    agent = QAgent(env, capacity=100000)
-    statistics = agent.learning(lambda_=0.8, gamma=1.0, epsilon=0.2,\
-        decaying_epsilon=True, alpha=0.5, max_episode_num=800, display=False,\
-        show=True)
\ No newline at end of file
+    ## Q学习的所有状态转换写到磁盘上，with结束时写出最后一块数据 ##
+    log_path = os.path.join(tempfile.gettempdir(), "windy_grid_q_agent.log")
+    with QAgent(env, experience=DiskExperience(log_path)) as agent:
+        statistics = agent.learning(lambda_=0.8, gamma=1.0, epsilon=0.2,\
+            decaying_epsilon=True, alpha=0.5, max_episode_num=800, display=False,\
+            show=True)
+    print("max |Q - Q*|: {:.3f}, {} transitions in {}".format(
+        utils.q_error(agent, Q_star), len(DiskExperience.read_log(log_path)), log_path))
+    print("-"*120)
+    
+    ## 基于模型的个体：每个真实的时间步之后做若干次模拟更新 ##
+    for prioritized in [False, True]:
+        agent = DynaQAgent(env, capacity=100000, n_planning=20, prioritized=prioritized)
+        statistics = agent.learning(lambda_=0.8, gamma=1.0, epsilon=0.2,\
+            decaying_epsilon=True, alpha=0.5, max_episode_num=200, display=False,\
+            show=True)
+        print("env steps: {}, planning backups: {}, max |Q - Q*|: {:.3f}".format(
+            statistics[0][-1], agent.planning_backups, utils.q_error(agent, Q_star)))
+        print("-"*120)
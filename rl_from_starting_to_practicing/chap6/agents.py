@@ -38,12 +38,7 @@ class DQNAgent(Agent):
             return int(np.argmax(Qs))
     
     def _learn_from_memory(self, gamma, learning_rate):
-        trans_pieces = self.sample(self.batch_size)
-        s0 = np.vstack([x.s0 for x in trans_pieces])
-        a0 = np.array([x.a0 for x in trans_pieces])
-        r1 = np.array([x.reward for x in trans_pieces])
-        is_done = np.array([x.is_done for x in trans_pieces])
-        s1 = np.vstack([x.s1 for x in trans_pieces])
+        s0, a0, r1, is_done, s1 = self.sample_batch(self.batch_size)
 
         x_batch = s0
         y_batch = self.target_Q(s0)
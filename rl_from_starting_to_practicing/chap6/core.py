@@ -101,14 +101,26 @@ class Episode(object):
 
 class Experience(object):
     '''this class is used to record the whole experience of an agent organized
-    by an episode list. agent can randomly sample transitions or episodes from
+    by episodes. agent can randomly sample transitions or episodes from
     its experience.
+    transitions are stored in a circular buffer of columnar arrays (s0, a0,
+    reward, is_done, s1) and episodes are described by their boundaries in
+    another circular buffer, so that both push and eviction cost O(1).
     '''
     def __init__(self, capacity:int = 20000):
         self.capacity = capacity    # 容量：指的是trans总数量
-        self.episodes = []          # episode列表
-        self.next_id = 0            # 下一个episode的Id
+        self.next_id = 0            # 下一个episode的Id，也是episode的全局序号
         self.total_trans = 0        # 总的状态转换数量
+        self._next_trans = 0        # 下一个trans的全局序号
+        self._first_id = 0          # 最早的一个episode的Id
+        # 各列在第一次push时根据数据的形状和类型分配
+        self._s0, self._a0, self._s1 = None, None, None
+        self._reward = np.zeros(max(capacity, 0), dtype=np.float64)
+        self._is_done = np.zeros(max(capacity, 0), dtype=bool)
+        # episode边界：起始trans的全局序号、长度、总奖励
+        self._ep_start = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._ep_len = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._ep_reward = np.zeros(max(capacity, 0), dtype=np.float64)
         
     def __str__(self):
         return "exp info:{0:5} episodes, memory usage {1}/{2}".\
@@ -119,45 +131,80 @@ class Experience(object):
 
     @property
     def len(self):
-        return len(self.episodes)
-
-    def _remove(self, index = 0):      
-        '''扔掉一个Episode，默认第一个。
-           remove an episode, defautly the first one.
-           args: 
-               the index of the episode to remove
-           return:
-               if exists return the episode else return None
+        return self.next_id - self._first_id
+
+    @property
+    def episodes(self):
+        '''所有episode，按需从缓冲区中生成
         '''
-        if index > self.len - 1:
-            raise(Exception("invalid index"))
-        if self.len > 0:
-            episode = self.episodes[index]
-            self.episodes.remove(episode)
-            self.total_trans -= episode.len
-            return episode
-        else:
-            return None
+        return [self._episode(e_id) for e_id in range(self._first_id, self.next_id)]
+
+    def _allocate(self, s0, a0):
+        s0, a0 = np.asarray(s0), np.asarray(a0)
+        self._s0 = np.zeros((self.capacity,) + s0.shape, dtype=s0.dtype)
+        self._s1 = np.zeros((self.capacity,) + s0.shape, dtype=s0.dtype)
+        self._a0 = np.zeros((self.capacity,) + a0.shape, dtype=a0.dtype)
 
     def _remove_first(self):
-        self._remove(index = 0)
+        '''扔掉最早的一个Episode。
+           remove the first (oldest) episode.
+        '''
+        if self.len > 0:
+            self.total_trans -= self._ep_len[self._first_id % self.capacity]
+            self._first_id += 1
+
+    def _last_complete(self):
+        if self.len == 0:
+            return True
+        slot = (self.next_id - 1) % self.capacity
+        last = self._ep_start[slot] + self._ep_len[slot] - 1
+        return bool(self._is_done[last % self.capacity])
 
     def push(self, trans): 
         '''压入一个状态转换
         '''
         if self.capacity <= 0:
             return
-        while self.total_trans >= self.capacity: # 可能会有空episode吗？
-            episode = self._remove_first()
-        cur_episode = None
-        if self.len == 0 or self.episodes[self.len-1].is_complete():
-            cur_episode = Episode(self.next_id)
+        s0, a0, reward, is_done, s1 = trans
+        if self._s0 is None:
+            self._allocate(s0, a0)
+        while self.total_trans >= self.capacity:
+            self._remove_first()
+        if self._last_complete():
+            slot = self.next_id % self.capacity
+            self._ep_start[slot] = self._next_trans
+            self._ep_len[slot] = 0
+            self._ep_reward[slot] = 0
             self.next_id += 1
-            self.episodes.append(cur_episode)
-        else:
-            cur_episode = self.episodes[self.len-1]
+        
+        i = self._next_trans % self.capacity
+        self._s0[i], self._a0[i], self._s1[i] = s0, a0, s1
+        self._reward[i], self._is_done[i] = reward, is_done
+        self._next_trans += 1
         self.total_trans += 1
-        return cur_episode.push(trans)      #return  total reward of an episode
+        
+        slot = (self.next_id - 1) % self.capacity
+        self._ep_len[slot] += 1
+        self._ep_reward[slot] += reward
+        return self._ep_reward[slot].item()     #return  total reward of an episode
+
+    def _transition(self, i):
+        i = i % self.capacity
+        s0, a0, s1 = self._s0[i], self._a0[i], self._s1[i]
+        if s0.ndim == 0:
+            s0, s1 = s0.item(), s1.item()
+        else:
+            s0, s1 = s0.copy(), s1.copy()
+        a0 = a0.item() if a0.ndim == 0 else a0.copy()
+        return Transition(s0, a0, self._reward[i].item(), bool(self._is_done[i]), s1)
+
+    def _episode(self, e_id):
+        slot = e_id % self.capacity
+        episode = Episode(e_id)
+        start = self._ep_start[slot]
+        for i in range(start, start + self._ep_len[slot]):
+            episode.push(self._transition(i))
+        return episode
 
     def sample(self, batch_size=1): # sample transition
         '''randomly sample some transitions from agent's experience.abs
@@ -167,21 +214,41 @@ class Experience(object):
         return:
             list of Transition.
         '''
-        sample_trans = []
-        for _ in range(batch_size):
-            index = int(random.random() * self.len)
-            sample_trans += self.episodes[index].sample()
-        return sample_trans
+        # 先随机选择episode，再在episode内随机选择trans
+        slots = (self._first_id + np.random.randint(self.len, size=batch_size)) \
+                % self.capacity
+        offsets = (np.random.random(batch_size) * self._ep_len[slots]).astype(np.int64)
+        return [self._transition(i) for i in self._ep_start[slots] + offsets]
+
+    def sample_batch(self, batch_size=128, replace=True):
+        '''在所有trans上均匀随机取样，一次性得到整批数据
+        args:
+            batch_size: number of transitions need to be sampled
+            replace: whether a transition can be drawn more than once
+        return:
+            contiguous arrays (s0, a0, reward, is_done, s1), each with
+            batch_size rows.
+        '''
+        first = self._ep_start[self._first_id % self.capacity]
+        if replace:
+            offsets = np.random.randint(self.total_trans, size=batch_size)
+        else:
+            offsets = np.random.choice(self.total_trans, size=batch_size,
+                                       replace=False)
+        i = (first + offsets) % self.capacity
+        return self._s0[i], self._a0[i], self._reward[i], self._is_done[i], \
+               self._s1[i]
 
     def sample_episode(self, episode_num = 1):  # sample episode
         '''随机获取一定数量完整的Episode
         '''
-        return random.sample(self.episodes, k = episode_num)
+        e_ids = random.sample(range(self._first_id, self.next_id), k = episode_num)
+        return [self._episode(e_id) for e_id in e_ids]
 
     @property
     def last_episode(self):
         if self.len > 0:
-            return self.episodes[self.len-1]
+            return self._episode(self.next_id - 1)
         return None
     
 
@@ -287,6 +354,11 @@ class Agent(object):
         '''
         return self.experience.sample(batch_size)
 
+    def sample_batch(self, batch_size = 128, replace = True):
+        '''均匀随机取样，返回数组(s0, a0, reward, is_done, s1)
+        '''
+        return self.experience.sample_batch(batch_size, replace)
+
     @property
     def total_trans(self):
         '''得到Experience里记录的总的状态转换数量
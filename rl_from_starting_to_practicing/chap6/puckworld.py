@@ -128,12 +128,106 @@ class PuckWorldEnv(gym.Env):
         return self.state   # np.array(self.state)
 
 
+    def _build_sprites(self):
+        '''预先计算个体、目标的圆盘和边框以及四个方向箭头的像素偏移量，
+        绘制时只需把偏移量加到中心坐标上
+        '''
+        scale = self.width/self.l_unit
+        rad, t_rad = self.rad * scale, self.target_rad * scale
+
+        def disc(radius):
+            r = int(np.ceil(radius))
+            dy, dx = np.mgrid[-r:r+1, -r:r+1]
+            d = np.hypot(dx, dy)
+            fill, ring = d <= radius, (d <= radius) & (d > radius - 1.5)
+            return (dy[fill], dx[fill]), (dy[ring], dx[ring])
+
+        self._agent_disc, self._agent_ring = disc(rad)
+        self._target_disc, self._target_ring = disc(t_rad)
+        ## 箭头是(0.7r,0.15r),(r,0),(0.7r,-0.15r)围成的三角形，按行为旋转 ##
+        r = int(np.ceil(rad))
+        dy, dx = np.mgrid[-r:r+1, -r:r+1]
+        self._arrows = {}
+        for a, degree in [(0, 180), (1, 0), (2, 90), (3, 270)]:
+            c, s = math.cos(degree/RAD2DEG), math.sin(degree/RAD2DEG)
+            # 图像的行向下增长，世界坐标中的y是-dy，旋转到箭头的局部坐标(u, v)
+            u, v = dx*c - dy*s, -dx*s - dy*c
+            inside = (u >= 0.7*rad) & (u <= rad) & \
+                     (np.abs(v) <= 0.15*rad * (rad - u) / (0.3*rad))
+            self._arrows[a] = (dy[inside], dx[inside])
+
+    def _stamp(self, frames, index, cy, cx, offsets, colors):
+        '''在帧frames[index[i]]中以(cy[i], cx[i])为中心按偏移量填充颜色，
+        colors是一种颜色或者按帧编号排列的每一帧的颜色
+        '''
+        dy, dx = offsets
+        ys, xs = cy[:, None] + dy, cx[:, None] + dx
+        t = np.broadcast_to(index[:, None], ys.shape)
+        ok = (ys >= 0) & (ys < frames.shape[1]) & (xs >= 0) & (xs < frames.shape[2])
+        colors = np.asarray(colors, dtype=np.float64)
+        if colors.ndim == 2:
+            colors = colors[t[ok]]
+        frames[t[ok], ys[ok], xs[ok]] = (colors * 255).astype(np.uint8)
+
+    def render_trajectory(self, states, rewards = None, actions = None):
+        '''不依赖图形界面，把一条轨迹一次性绘制成rgb数组[T, height, width, 3]。
+        args:
+            states: 形状为[T, 6]的状态序列
+            rewards: 每一帧个体着色用的奖励，None时按状态重新计算
+            actions: 每一帧的行为，用来绘制箭头，None时不绘制
+        '''
+        if not hasattr(self, "_agent_disc"):
+            self._build_sprites()
+        states = np.asarray(states, dtype=np.float64).reshape(-1, 6)
+        scale = self.width/self.l_unit
+        if rewards is None:
+            dis = np.hypot(states[:, 0] - states[:, 4], states[:, 1] - states[:, 5])
+            rewards = self.goal_dis - dis
+        frames = np.full((len(states), self.height, self.width, 3), 255, dtype=np.uint8)
+        self._draw(frames, states, np.asarray(rewards, dtype=np.float64), actions, scale)
+        return frames
+
+    def _draw(self, frames, states, rewards, actions, scale):
+        index = np.arange(len(states))
+        ty = np.rint(self.height - 1 - states[:, 5]*scale).astype(np.int64)
+        tx = np.rint(states[:, 4]*scale).astype(np.int64)
+        py = np.rint(self.height - 1 - states[:, 1]*scale).astype(np.int64)
+        px = np.rint(states[:, 0]*scale).astype(np.int64)
+        self._stamp(frames, index, ty, tx, self._target_disc, (0.1, 0.9, 0.1))
+        self._stamp(frames, index, ty, tx, self._target_ring, (0, 0, 0))
+        # 按距离给Agent着色
+        vv = (rewards + 0.3)[:, None]
+        colors = np.where(vv >= 0, np.hstack([1 - vv, 1 + 0*vv, 1 - vv]),
+                                   np.hstack([1 + 0*vv, 1 + vv, 1 + vv]))
+        self._stamp(frames, index, py, px, self._agent_disc, np.clip(colors, 0, 1))
+        self._stamp(frames, index, py, px, self._agent_ring, (0, 0, 0))
+        if actions is not None:
+            actions = np.asarray(actions).reshape(-1)
+            for a, offsets in self._arrows.items():
+                t = np.flatnonzero(actions == a)
+                self._stamp(frames, t, py[t], px[t], offsets, (0, 0, 0))
+
+    def render_frame(self):
+        '''当前状态的rgb数组[height, width, 3]，复用同一块帧缓存
+        '''
+        if not hasattr(self, "_frame"):
+            self._build_sprites()
+            self._frame = np.empty((1, self.height, self.width, 3), dtype=np.uint8)
+        self._frame.fill(255)
+        self._draw(self._frame, np.asarray(self.state, dtype=np.float64).reshape(1, 6),
+                   np.array([self.reward], dtype=np.float64),
+                   None if self.action is None else [self.action],
+                   self.width/self.l_unit)
+        return self._frame[0].copy()
+
     def render(self, mode='human', close=False):
         if close:
             if self.viewer is not None:
                 self.viewer.close()
                 self.viewer = None
             return
+        if mode == 'rgb_array':
+            return self.render_frame()
 
         scale = self.width/self.l_unit      # 计算两者映射关系
         rad = self.rad * scale              # 随后都是用世界尺寸来描述